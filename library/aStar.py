@@ -19,6 +19,12 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 02110-1301 USA
 """
+import heapq, math, numpy
+
+if __name__ == '__main__': # handle multiple entry points
+    from constants import *
+else:
+    from .constants import *
 
 class Path:
 
@@ -206,13 +212,130 @@ class SQ_MapHandler:
         return None
 
 
+class GridAStar:
+    """A* straight over a heightmap: a binary heap as the open list, with
+    stale entries skipped when popped, and the move cost and parent of every
+    cell kept in flat arrays. Entering a cell costs its elevation, diagonal
+    steps DIAGONAL_COST times that.
+
+    The arrays are allocated once and shared by every search on the same
+    heightmap; a cell's entries only count when its stamp matches the
+    current search, so nothing has to be cleared in between."""
+
+    def __init__( self, heightmap, wrap = False, connectivity = 4, limit = 10000 ):
+        self.heightmap = heightmap
+        self.w, self.h = heightmap.shape
+        self.m = heightmap.reshape( -1 ) # a view, follows changes to the heightmap
+        self.wrap = wrap
+        self.limit = limit # bail out after expanding this many cells
+        if connectivity == 8:
+            directions = DIR_ALL
+        else:
+            directions = DIR_NEIGHBORS
+        self.moves = [( dx, dy, DIAGONAL_COST if dx and dy else 1.0 ) for dx, dy in directions]
+        self.diagonal = connectivity == 8
+
+        self.mCost = numpy.zeros( self.w * self.h )
+        self.parent = numpy.zeros( self.w * self.h, dtype = numpy.int64 )
+        self.stamp = numpy.zeros( self.w * self.h, dtype = numpy.uint32 )
+        self.generation = 0
+
+    def _distance( self, x, y, destinations ):
+        best = math.inf
+        for destx, desty in destinations:
+            dx = abs( x - destx )
+            dy = abs( y - desty )
+            if self.wrap:
+                dx = min( dx, self.w - dx )
+                dy = min( dy, self.h - dy )
+            if self.diagonal:
+                distance = max( dx, dy ) + ( DIAGONAL_COST - 1.0 ) * min( dx, dy )
+            else:
+                distance = dx + dy
+            best = min( best, distance )
+        return best
+
+    def find( self, source, destination ):
+        return self.findNearest( source, [destination] )
+
+    def findNearest( self, source, destinations ):
+        '''Cheapest path from source to whichever of destinations it reaches
+        first'''
+        sx, sy = source
+        w, h, m = self.w, self.h, self.m
+        mCost, parent, stamp = self.mCost, self.parent, self.stamp
+        start = sx * h + sy
+        ends = set( x * h + y for x, y in destinations )
+
+        self.generation += 1
+        if self.generation == 2 ** 32: # stamps would come round again
+            stamp.fill( 0 )
+            self.generation = 1
+        generation = self.generation
+        stamp[start] = generation
+        mCost[start] = 0.0
+        openList = [( self._distance( sx, sy, destinations ), 0.0, start )]
+
+        counter = 0
+        while openList:
+            score, cost, lid = heapq.heappop( openList )
+            if cost > mCost[lid]:
+                continue # a better way here was found since, skip this
+            if lid in ends:
+                break # reached a destination
+            counter += 1
+            if counter > self.limit:
+                return [] # no path found under limit
+
+            x, y = divmod( lid, h )
+            for dx, dy, step in self.moves:
+                nx, ny = x + dx, y + dy
+                if self.wrap:
+                    nx, ny = nx % w, ny % h
+                elif nx < 0 or nx >= w or ny < 0 or ny >= h:
+                    continue
+                n = nx * h + ny
+                nCost = cost + m[n] * step
+                if stamp[n] != generation or nCost < mCost[n]:
+                    stamp[n] = generation
+                    mCost[n] = nCost
+                    parent[n] = lid
+                    heapq.heappush( openList, ( nCost + self._distance( nx, ny, destinations ), nCost, n ) )
+        else:
+            return []
+
+        # walk back to the source, which is left out of the path
+        path = []
+        while lid != start:
+            path.append( list( divmod( int( lid ), h ) ) )
+            lid = parent[lid]
+        path.reverse()
+        return path
+
+
 class pathFinder:
     '''Using the a* algo we will try to find the best path between two
     points'''
-    def __init__( self ):
-        pass
+    def __init__( self, wrap = False, connectivity = 4 ):
+        self.wrap = wrap
+        self.connectivity = connectivity
+        self.grid = None
+
+    def _bind( self, heightmap ):
+        # searches on the same heightmap share one GridAStar
+        if self.grid is None or self.grid.heightmap is not heightmap:
+            self.grid = GridAStar( heightmap, self.wrap, self.connectivity )
+        return self.grid
 
     def find( self, heightmap, source, destination ):
+        return self._bind( heightmap ).find( source, destination )
+
+    def findNearest( self, heightmap, source, destinations ):
+        return self._bind( heightmap ).findNearest( source, destinations )
+
+    def findSquare( self, heightmap, source, destination ):
+        '''The original list based search, which the benchmark below times find
+        against; it reads the heightmap transposed and does not wrap'''
         sx, sy = source
         dx, dy = destination
         path = []
@@ -237,4 +360,29 @@ class pathFinder:
         for node in p.nodes:
             path.append( [node.location.x, node.location.y] )
 
-        return path
\ No newline at end of file
+        return path
+
+if __name__ == '__main__':
+    import sys, time
+    sizes = [int( size ) for size in sys.argv[1:]] or [256, 1024]
+    for size in sizes:
+        # smoothed noise, so paths have to find their way around
+        heightmap = numpy.random.default_rng( 1 ).random( ( size, size ) )
+        for step in range( 4 ):
+            heightmap = ( heightmap + numpy.roll( heightmap, 1, 0 ) + numpy.roll( heightmap, 1, 1 ) ) / 3.0
+        rng = numpy.random.default_rng( 2 )
+        queries = []
+        for i in range( 10 ):
+            sx, sy = rng.integers( 0, size, 2 ).tolist()
+            dx, dy = rng.integers( -30, 31, 2 ).tolist()
+            queries.append( ( [sx, sy], [min( max( sx + dx, 0 ), size - 1 ), min( max( sy + dy, 0 ), size - 1 )] ) )
+
+        # the steeper the terrain, the wider the search around the straight line
+        for steepness in [1, 20]:
+            terrain = heightmap * steepness
+            for name in ['find', 'findSquare']:
+                finder = getattr( pathFinder(), name ) # one finder for all the queries
+                start = time.time()
+                found = sum( 1 for source, destination in queries if finder( terrain, source, destination ) )
+                print( "%-10s %4d steepness %2d: %.3f seconds, %d of %d paths found" % ( name, size, steepness,
+                       time.time() - start, found, len( queries ) ) )
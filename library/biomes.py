@@ -20,6 +20,7 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 02110-1301 USA
 """
 import sys
+import numpy
 from numpy import zeros
 
 if __name__ == '__main__': # handle multiple entry points
@@ -27,6 +28,107 @@ if __name__ == '__main__': # handle multiple entry points
 else:
     from .constants import *
 
+INF = float('inf')
+
+# Highlands, decided by elevation alone: (biome, above, up to and including)
+BIOME_ELEVATION_RULES = [
+    (BIOME_TYPE_MOUNTAIN_LOW,     0.75, 0.83), # Mountain (Low): e300-332
+    (BIOME_TYPE_MOUNTAIN,         0.83, 0.91), # Mountain: e333-365
+    (BIOME_TYPE_MOUNTAIN_HIGH,    0.91, 1.00), # Mountain (High): e366-400
+]
+
+# Lowlands, all other biomes are between elevations of 100 and 299 (25-74)
+# (biome, (rainfall from, to), (drainage from, to)), ranges include their
+# lower bound only and the first matching rule wins
+BIOME_RULES = [
+    (BIOME_TYPE_DESERT_SAND,      (-INF, 0.10), (-INF, 0.33)), # Desert (Sand): r0-9, d0-32
+    (BIOME_TYPE_DESERT_ROCK,      (-INF, 0.10), (0.33, 0.50)), # Desert (Rock): r0-9, d33-49
+    (BIOME_TYPE_DESERT_BADLANDS,  (-INF, 0.10), (0.50,  INF)), # Desert (Badlands): r0-9, d50-100
+    (BIOME_TYPE_GRASSLAND,        (0.10, 0.20), (-INF, 0.51)), # Grassland: r10-19, d0-50
+    (BIOME_TYPE_HILLS,            (0.10, 0.20), (0.51,  INF)), # Hills: r10-65, d50-100
+    (BIOME_TYPE_SAVANNA,          (0.20, 0.33), (-INF, 0.50)), # Savanna: r20-32, d0-50
+    (BIOME_TYPE_HILLS,            (0.20, 0.33), (0.50, 0.80)),
+    (BIOME_TYPE_FOREST,           (0.20, 0.33), (0.80,  INF)),
+    (BIOME_TYPE_MARSH,            (0.33, 0.66), (-INF, 0.33)), # Marsh: r33-65, d0-32
+    (BIOME_TYPE_SHRUBLAND,        (0.33, 0.66), (0.33, 0.50)), # Shrubland: r33-65, d33-49
+    (BIOME_TYPE_HILLS,            (0.33, 0.66), (0.50, 0.80)),
+    (BIOME_TYPE_FOREST,           (0.33, 0.66), (0.80,  INF)),
+    (BIOME_TYPE_SWAMP,            (0.66,  INF), (-INF, 0.33)), # Swamp: r66-100, d0-32
+    (BIOME_TYPE_FOREST,           (0.66,  INF), (0.33,  INF)), # Forest: r66-100, d33-100
+]
+
+BIOME_COLOURS = {
+    BIOME_TYPE_UNDEFINED:         COLOR_RED, # for debugging
+    BIOME_TYPE_WATER:             COLOR_BLUE,
+    BIOME_TYPE_GRASSLAND:         COLOR_GREEN,
+    BIOME_TYPE_FOREST:            COLOR_DARK_GREEN,
+    BIOME_TYPE_DESERT_SAND:       COLOR_GOLDEN_YELLOW,
+    BIOME_TYPE_DESERT_ROCK:       COLOR_DARK_CHESTNUT,
+    BIOME_TYPE_MOUNTAIN_LOW:      COLOR_GRAY,
+    BIOME_TYPE_MOUNTAIN_HIGH:     COLOR_IVORY,
+    BIOME_TYPE_SAVANNA:           COLOR_GREEN_YELLOW,
+    BIOME_TYPE_MARSH:             0x2B2E26,
+    BIOME_TYPE_SHRUBLAND:         COLOR_FERN_GREEN,
+    BIOME_TYPE_HILLS:             COLOR_EMERALD,
+    BIOME_TYPE_SWAMP:             COLOR_AMETHYST,
+    BIOME_TYPE_DESERT_BADLANDS:   COLOR_TAUPE_PALE,
+    BIOME_TYPE_MOUNTAIN:          COLOR_ASH_GRAY,
+}
+
+def ruleEdges(ranges):
+    '''Sorted, finite bin edges of a list of (from, to) ranges'''
+    edges = set()
+    for low, high in ranges:
+        edges.update((low, high))
+    return numpy.array(sorted(e for e in edges if -INF < e < INF))
+
+def digitize(data, edges, right=False):
+    '''Same bins as numpy.digitize for a handful of sorted edges, counted
+    with one comparison per edge which is several times faster'''
+    bins = zeros(data.shape, dtype=numpy.uint8)
+    for edge in edges:
+        if right:
+            bins += data > edge
+        else:
+            bins += data >= edge
+    return bins
+
+def elevationTable(rules):
+    '''Bin edges and the biome of every bin, bins include their upper edge'''
+    edges = ruleEdges([(low, high) for biome, low, high in rules])
+    table = zeros(len(edges) + 1, dtype=numpy.uint8)
+    for i in range(len(table)):
+        value = edges[i] if i < len(edges) else INF # upper edge of this bin
+        for biome, low, high in rules:
+            if low < value <= high:
+                table[i] = biome
+                break
+    return edges, table
+
+def biomeTable(rules):
+    '''Rainfall and drainage bin edges and the biome of every pair of bins,
+    bins include their lower edge'''
+    rainEdges = ruleEdges([rain for biome, rain, drain in rules])
+    drainEdges = ruleEdges([drain for biome, rain, drain in rules])
+    table = zeros((len(rainEdges) + 1, len(drainEdges) + 1), dtype=numpy.uint8)
+    for i in range(table.shape[0]):
+        rain = rainEdges[i - 1] if i > 0 else -INF # lower edge of this bin
+        for j in range(table.shape[1]):
+            drain = drainEdges[j - 1] if j > 0 else -INF
+            for biome, (rainLow, rainHigh), (drainLow, drainHigh) in rules:
+                if rainLow <= rain < rainHigh and drainLow <= drain < drainHigh:
+                    table[i, j] = biome
+                    break
+    return rainEdges, drainEdges, table
+
+def biomePalette(colours):
+    '''Colour of every biome id, undefined for ids without one'''
+    palette = numpy.empty(256, dtype=numpy.uint32)
+    palette[:] = colours[BIOME_TYPE_UNDEFINED]
+    for biome, colour in colours.items():
+        palette[biome] = colour
+    return palette
+
 class Biomes():
 
     def __init__(self, *args, **kwargs):
@@ -39,14 +141,38 @@ class Biomes():
             self.temperature = args[3]
             self.worldW = len(self.heightmap)
             self.worldH = len(self.heightmap[0])
-            self.biome = zeros((self.worldW, self.worldH))
-            self.biomeColourCode = zeros((self.worldW, self.worldH))
+            self.biome = zeros((self.worldW, self.worldH), dtype=numpy.uint8)
+            self.biomeColourCode = zeros((self.worldW, self.worldH), dtype=numpy.uint32)
             self.seaLevel = args[4] / 100.0 # reduce to 0.0 - 1.0 range
             
         else:
             sys.exit('0 or 4 arguments only')
 
     def run(self):
+        # calculate biome -- from scale of 0-400 ((oldValue-0) * (100-0)) / (400-0) + 0
+        elevationEdges, highlands = elevationTable(BIOME_ELEVATION_RULES)
+        rainEdges, drainEdges, lowlands = biomeTable(BIOME_RULES)
+
+        # lowland biomes from rainfall and drainage
+        bins = digitize(self.rainmap, rainEdges) * numpy.uint8(lowlands.shape[1])
+        bins += digitize(self.drainmap, drainEdges)
+        biome = numpy.take(lowlands.ravel(), bins)
+
+        # highland biomes from elevation, they win over the lowland ones
+        highland = numpy.take(highlands, digitize(self.heightmap, elevationEdges, right=True))
+        numpy.copyto(biome, highland, where=highland != BIOME_TYPE_UNDEFINED)
+
+        # and water wins over everything
+        numpy.copyto(biome, BIOME_TYPE_WATER, where=self.heightmap <= self.seaLevel) # Sealevel: e1-99 (0-98)
+
+        self.biome = biome
+        self.biomeColourCode = numpy.take(biomePalette(BIOME_COLOURS), biome)
+
+    def runLoop(self):
+        '''The original cell by cell classification, the benchmark below
+        checks that run() agrees with it'''
+        self.biome = zeros((self.worldW, self.worldH))
+        self.biomeColourCode = zeros((self.worldW, self.worldH))
         # calculate biome -- from scale of 0-400 ((oldValue-0) * (100-0)) / (400-0) + 0
         for x in range(self.worldW):
             for y in range(self.worldH):
@@ -155,5 +281,18 @@ class Biomes():
 
 
 if __name__ == '__main__':
-    biomes = Biomes()
-    print(biomes)
+    import time
+    for size in [256, 1024, 4096]:
+        heightmap = numpy.random.random((size, size))
+        rainmap = numpy.random.random((size, size))
+        drainmap = numpy.random.random((size, size))
+        biomes = Biomes(heightmap, rainmap, drainmap, None, 25)
+        start = time.time()
+        biomes.run()
+        print("run     %4d: %.3f seconds" % (size, time.time() - start))
+        if size <= 256:
+            biome, colour = biomes.biome, biomes.biomeColourCode
+            start = time.time()
+            biomes.runLoop()
+            print("runLoop %4d: %.3f seconds, same biomes: %s" % (size, time.time() - start,
+                  (biome == biomes.biome).all() and (colour == biomes.biomeColourCode).all()))
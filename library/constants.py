@@ -47,6 +47,11 @@ HM_DSA      = 1
 HM_SPH      = 2
 HM_PERLIN   = 3
 
+# Island masks, applied to heightmaps
+MASK_RADIAL     = 1
+MASK_PARTICLE   = 2
+MASK_PARTICLE_BUDGET = 2 ** 18 # most particles rolled for a MASK_PARTICLE mask, one per cell on smaller maps
+
 #Viewer types
 VIEWER_HEIGHTMAP    = 0
 VIEWER_HEATMAP      = 1
@@ -58,6 +63,14 @@ VIEWER_RIVERS       = 6
 VIEWER_EROSION      = 7
 VIEWER_EROSIONAPP   = 8
 
+# Memory allowed for rendered maps kept around for revisiting a view, in bytes
+RENDER_CACHE_BUDGET = 256 * 1024 * 1024
+
+# Disk space allowed for generated layers kept in the layer cache, in bytes
+LAYER_CACHE_QUOTA = 2 * 1024 * 1024 * 1024
+LAYER_CACHE_VERSION = 2 # bump when the stages generate other layers from the same inputs
+LAYER_CACHE_PARTIAL_AGE = 60 * 60 # seconds after which an entry still being written was left by a crash
+
 #Biomes
 BIOME_TYPE_UNDEFINED = 0
 BIOME_TYPE_WATER = 1
@@ -95,8 +108,18 @@ WIND_PARITY = -1 # -1 or 1
 WGEN_WIND_RESOLUTION = 4 # 1 is perfect, higher = rougher
 WGEN_RAIN_FALLOFF = 0.2 # Default 0.2 - less for less rain, more for more rain
 WGEN_WIND_GRAVITY = 0.975
+WGEN_LAKE_MIN_DEPTH = 0.01 # rivers end in lakes at least this deep
 TEMPERATURE_BAND_RESOLUTION = 2 # 1 is perfect, higher = rougher
 
+# Generation stages, each draws from a random stream of its own derived
+# from the world seed, see utilities.stageSeed
+STAGE_HEIGHTMAP = 1
+STAGE_HEMISPHERE = 2
+STAGE_TEMPERATURE = 3
+STAGE_WEATHER = 4
+STAGE_DRAINAGE = 5
+STAGE_RIVERS = 6
+
 
 #Colour contant
 # http://df.magmawiki.com/index.php/Colour (as reference)
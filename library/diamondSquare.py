@@ -29,19 +29,75 @@ def avg(*args):
     return sum(args)/len(args)    
 
 class DSA():
-    def __init__(self, size):
+    def __init__(self, size, seed=None):
         ''' Create our initial heightmap '''
         self.size = [x+1 for x in size]
         self.heightmap = numpy.zeros(self.size)
         self.noise_min = -1.0
         self.noise_max = 1.0
+        self.seed = seed
         
     def randomHeightGen(self, i):
         ''' Random uniform distribution based on on min/max '''
         return uniform(self.noise_min*2**-i, self.noise_max*2**-i)
-    
+
     def run(self):
-        ''' Square Diamond Algo '''
+        ''' Square Diamond Algo, each refinement pass is done on the whole
+        array at once with the noise for a pass drawn in one call. Edges wrap
+        on a power of 2 size only: other sizes are cropped from the power of 2
+        square that covers them, and no longer tile '''
+        rng = numpy.random.default_rng(self.seed)
+        width, height = [x-1 for x in self.size]
+
+        # work on a power of 2 square that covers our size, crop afterwards
+        side = 1
+        while side < max(width, height):
+            side *= 2
+        heightmap = numpy.zeros((side+1, side+1))
+
+        corner = rng.uniform(self.noise_min, self.noise_max)
+        heightmap[0::side, 0::side] = corner
+
+        i = 0
+        while side > 1:
+            half = side // 2
+            corners = heightmap[::side, ::side]
+            squares = corners.shape[0] - 1
+            low, high = self.noise_min*2**-i, self.noise_max*2**-i
+            noise = rng.uniform(low, high, (3, squares, squares)) # centers, left, top
+
+            #Diamond step- create center avg for each square
+            centers = (corners[:-1, :-1] + corners[1:, :-1] + 
+                       corners[:-1, 1:] + corners[1:, 1:]) / 4.0
+            centers += noise[0]
+            heightmap[half::side, half::side] = centers
+
+            #Square step- left edge of each square, wrapping on x
+            left = (corners[:-1, :-1] + corners[:-1, 1:] + centers + 
+                    numpy.roll(centers, 1, axis=0)) / 4.0
+            left += noise[1]
+            heightmap[0:-1:side, half::side] = left
+            heightmap[-1, half::side] = left[0]
+
+            #Square step- top edge of each square, wrapping on y
+            top = (corners[:-1, :-1] + corners[1:, :-1] + centers + 
+                   numpy.roll(centers, 1, axis=1)) / 4.0
+            top += noise[2]
+            heightmap[half::side, 0:-1:side] = top
+            heightmap[half::side, -1] = top[:, 0]
+
+            #Refine the pass
+            side = half
+            i += 1
+
+        self.heightmap = heightmap[:width+1, :height+1]
+
+        #trim up heightmap to be power of 2
+        self.heightmap = numpy.delete(numpy.delete(self.heightmap,1,0),1,1) 
+    
+    def runLoop(self):
+        ''' Square Diamond Algo, the original loop version kept around for
+        comparison '''
 
         corner = self.randomHeightGen(0.0)
         self.heightmap[0,0]   = corner
@@ -66,8 +122,8 @@ class DSA():
                     y_top = y*side
                     y_bottom = (y+1)*side
     
-                    dx = side/2
-                    dy = side/2
+                    dx = side//2
+                    dy = side//2
     
                     xm = x_left + dx
                     ym = y_top + dy
@@ -141,7 +197,7 @@ class DSA():
                         self.heightmap[x_min,ym] = self.heightmap[x_right,ym]
     
             #Refine the pass
-            side /= 2
+            side //= 2
             squares *= 2
             i += 1
             
@@ -150,6 +206,15 @@ class DSA():
 
 # runs the program
 if __name__ == '__main__':
-    dsa = DSA((512,512))
-    import cProfile
-    cProfile.run( 'dsa.run()' )
+    from time import time
+    sizes = [int(x) for x in sys.argv[1:]] or [256, 1024, 4096]
+    for size in sizes:
+        dsa = DSA((size,size))
+        s = time()
+        dsa.run()
+        vectorized = time() - s
+        dsa = DSA((size,size))
+        s = time()
+        dsa.runLoop()
+        loop = time() - s
+        print("%5d: vectorized %8.3fs, loop %8.3fs, %6.1fx faster" % (size, vectorized, loop, loop / vectorized))
@@ -30,37 +30,48 @@ else:
     from . import utilities
 
 class HeightMap():
-    '''An heightmap generator with various backends'''
-    def __init__( self, size, roughness = 0.5, islands = False ):
+    '''An heightmap generator with various backends, islands masks the
+    heightmap with MASK_RADIAL (or True) or MASK_PARTICLE, rolling the given
+    number of particles, by default one per cell up to MASK_PARTICLE_BUDGET'''
+    def __init__( self, size, roughness = 0.5, islands = False, seed = None, particles = None ):
         self.size = size
         self.width, self.height = self.size
         self.roughness = roughness
         self.heightmap = None
         self.islands = islands
+        if particles is None:
+            particles = min(self.width * self.height, MASK_PARTICLE_BUDGET)
+        self.particles = particles
+        self.mask = None # made on the first run, retries only change the terrain
+        self.seed = seed
+        self.rng = numpy.random.default_rng(seed) # shared by every run, retries differ
 
     def run(self, method = None):      
         if method == HM_MDA:
             from .midpointDisplacement import MDA            
-            heightObject = MDA(self.size, self.roughness)
+            heightObject = MDA(self.size, self.roughness, self.rng)
         elif method == HM_DSA:
             from .diamondSquare import DSA
-            heightObject = DSA(self.size)
+            heightObject = DSA(self.size, self.rng)
         elif method == HM_SPH:
             from .sphere import Sphere
-            heightObject = Sphere(self.size, self.roughness)
+            heightObject = Sphere(self.size, self.roughness, self.rng)
         elif method == HM_PERLIN:
             from .perlinNoise import Perlin
-            heightObject = Perlin(self.size)
+            heightObject = Perlin(self.size, seed = self.rng)
         else:
             print("No method for generating heightmap found!")
         
         heightObject.run()
-        self.heightmap = utilities.normalize(heightObject.heightmap)
+        self.heightmap = utilities.normalize(heightObject.heightmap, inPlace=True)
         
         if self.islands:
-            gradient = utilities.radialGradient(self.size, True, True)
-            self.heightmap = self.heightmap * gradient
-            self.heightmap = utilities.normalize(self.heightmap)
+            if self.mask is None and self.islands == MASK_PARTICLE:
+                self.mask = utilities.rollingParticleGradient(self.size, particles = self.particles, seed = self.rng)
+            elif self.mask is None: # True or MASK_RADIAL
+                self.mask = utilities.radialGradient(self.size, True, True)
+            self.heightmap *= self.mask
+            utilities.normalize(self.heightmap, inPlace=True)
 
         del heightObject
 
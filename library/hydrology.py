@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Part of the World Generator project.
+
+author:  Bret Curtis
+license: LGPL v2
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+version 2 as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+02110-1301 USA
+"""
+#
+# Drainage of a heightmap: which way water flows out of every cell and
+# where it gathers into lakes.
+#
+# Every cell first flows to its steepest lower neighbour, which splits the
+# map into basins around the pits water gathers in. The basins are then
+# filled with a priority-flood, starting from the sea (and the map edges
+# when the map does not wrap): the lowest basin not yet drained is the next
+# to overflow into a drained neighbour at the lowest point of their shared
+# border. A basin's water level is the height it overflows at, cells below
+# it are under water and flow towards that overflow instead.
+#
+import heapq, math, numpy
+
+if __name__ == '__main__': # handle multiple entry points
+    from constants import *
+else:
+    from .constants import *
+
+class Hydrology():
+    '''Fills the depressions of a heightmap and finds the flow direction of
+    every cell, as an index into DIR_NEIGHBORS_CENTER (connectivity 4) or
+    DIR_ALL_CENTER (connectivity 8), 0 where water leaves the map or meets
+    the sea. The sea level is in the 0.0 - 1.0 range of the heightmap.'''
+
+    def __init__(self, heightmap, seaLevel, wrap=True, connectivity=4):
+        self.heightmap = heightmap
+        self.seaLevel = seaLevel
+        self.wrap = wrap
+        self.worldW, self.worldH = heightmap.shape
+        if connectivity == 8:
+            self.directions = DIR_ALL_CENTER
+        else:
+            self.directions = DIR_NEIGHBORS_CENTER
+
+        # direction index from an offset, and the one pointing back
+        self.directionOf = numpy.zeros((3, 3), dtype=numpy.int8)
+        for k, (dx, dy) in enumerate(self.directions):
+            self.directionOf[dx + 1, dy + 1] = k
+        self.opposite = [self.directionOf[1 - dx, 1 - dy] for dx, dy in self.directions]
+
+        self.filled = None      # heightmap with its depressions filled up to their water level
+        self.lakeDepth = None   # water depth of every cell, 0.0 outside of lakes
+        self.direction = None   # flow direction of every cell
+        self.receiver = None    # flat index of the cell each cell flows to, itself if none
+        self.basin = None       # basin of every cell, 0 is the sea and beyond the map edge
+
+    def run(self):
+        self.findSteepestDescent()
+        self.findBasins()
+        self.floodBasins()
+        self.drainLakes()
+        self.findReceivers()
+
+    def neighbours(self, cells, k):
+        '''Flat indices of the neighbours of cells in direction k, and whether
+        they are on the map'''
+        dx, dy = self.directions[k]
+        x, y = numpy.divmod(cells, self.worldH)
+        x = x + dx
+        y = y + dy
+        if self.wrap:
+            valid = numpy.ones(len(cells), dtype=bool)
+            x %= self.worldW
+            y %= self.worldH
+        else:
+            valid = (x >= 0) & (x < self.worldW) & (y >= 0) & (y < self.worldH)
+        return x * self.worldH + y, valid
+
+    def shifted(self, data, k, fill):
+        '''data of the neighbour in direction k for every cell, fill beyond
+        the edges of a map that does not wrap'''
+        dx, dy = self.directions[k]
+        if self.wrap:
+            padded = numpy.pad(data, 1, mode='wrap')
+        else:
+            padded = numpy.pad(data, 1, mode='constant', constant_values=fill)
+        return padded[1 + dx:1 + dx + self.worldW, 1 + dy:1 + dy + self.worldH]
+
+    def findSteepestDescent(self):
+        '''Flow direction of every cell to its steepest lower neighbour, in
+        one pass over the whole map per direction'''
+        self.direction = numpy.zeros((self.worldW, self.worldH), dtype=numpy.int8)
+        steepest = numpy.zeros((self.worldW, self.worldH))
+        for k in range(1, len(self.directions)):
+            dx, dy = self.directions[k]
+            slope = self.heightmap - self.shifted(self.heightmap, k, numpy.inf)
+            if dx and dy:
+                slope /= math.sqrt(2)
+            steeper = slope > steepest
+            self.direction[steeper] = k
+            numpy.copyto(steepest, slope, where=steeper)
+
+        # the sea, or the lowest point of a map without sea, drains the map
+        self.outlet = self.heightmap <= self.seaLevel
+        if not self.outlet.any() and self.wrap:
+            self.outlet.flat[numpy.argmin(self.heightmap)] = True
+        self.direction[self.outlet] = 0
+
+    def findBasins(self):
+        '''Label every cell with the basin of the pit it flows down into'''
+        cells = numpy.arange(self.worldW * self.worldH, dtype=numpy.int32)
+        receiver = flowReceivers(self.direction, self.directions, self.wrap)
+
+        # follow the flow to the pits, doubling the steps taken each round
+        pit = receiver
+        while True:
+            further = pit[pit]
+            if numpy.array_equal(further, pit):
+                break
+            pit = further
+
+        # basin 0 is the sea, every pit on land is a basin of its own
+        pits = numpy.flatnonzero((receiver == cells) & ~self.outlet.reshape(-1))
+        basinOfPit = numpy.zeros(len(cells), dtype=numpy.int32)
+        basinOfPit[pits] = numpy.arange(1, len(pits) + 1, dtype=numpy.int32)
+        self.basin = basinOfPit[pit]
+        self.basins = len(pits) + 1
+
+    def basinBorders(self):
+        '''Every pair of neighbouring basins with the lowest point of their
+        shared border: the height water overflows at, and the cell on either
+        side of it. Off the map counts as the sea, its cell is -1.'''
+        cells = numpy.arange(self.worldW * self.worldH, dtype=numpy.int32)
+        height = self.heightmap.reshape(-1)
+        basin = self.basin
+        low, high, lowCell, highCell, spill = [], [], [], [], []
+
+        # each pair of neighbours once: half of the directions
+        for k in range(1, len(self.directions)):
+            dx, dy = self.directions[k]
+            if (dx, dy) < (-dx, -dy):
+                continue
+            there, valid = self.neighbours(cells, k)
+            here = cells[valid]
+            there = there[valid]
+            border = basin[here] != basin[there]
+            here, there = here[border], there[border]
+            swap = basin[here] > basin[there]
+            low.append(numpy.where(swap, basin[there], basin[here]))
+            high.append(numpy.where(swap, basin[here], basin[there]))
+            lowCell.append(numpy.where(swap, there, here))
+            highCell.append(numpy.where(swap, here, there))
+            spill.append(numpy.maximum(height[here], height[there]))
+
+        # water can run off the edges of a map that does not wrap
+        if not self.wrap:
+            edge = numpy.zeros((self.worldW, self.worldH), dtype=bool)
+            edge[[0, -1], :] = True
+            edge[:, [0, -1]] = True
+            edge = numpy.flatnonzero(edge.reshape(-1) & (basin != 0))
+            low.append(numpy.zeros(len(edge), dtype=numpy.int32))
+            high.append(basin[edge])
+            lowCell.append(numpy.full(len(edge), -1, dtype=numpy.int32))
+            highCell.append(edge)
+            spill.append(height[edge])
+
+        low, high = numpy.concatenate(low), numpy.concatenate(high)
+        lowCell, highCell = numpy.concatenate(lowCell), numpy.concatenate(highCell)
+        spill = numpy.concatenate(spill)
+
+        # keep the lowest point of each border
+        pair = low.astype(numpy.int64) * self.basins + high
+        order = numpy.argsort(pair)
+        pair = pair[order]
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = pair[1:] != pair[:-1]
+        start = numpy.flatnonzero(first)
+        lowest = numpy.minimum.reduceat(spill[order], start)
+        lowest = numpy.repeat(lowest, numpy.diff(numpy.append(start, len(order))))
+        isLowest = spill[order] == lowest
+        order, pair = order[isLowest], pair[isLowest]
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = pair[1:] != pair[:-1]
+        order = order[first]
+        return low[order], high[order], lowCell[order], highCell[order], spill[order]
+
+    def floodBasins(self):
+        '''Priority-flood the basins from the sea, giving every basin its
+        water level and the border point it overflows at'''
+        low, high, lowCell, highCell, spill = self.basinBorders()
+
+        # borders of every basin, seen from either side
+        source = numpy.concatenate((low, high))
+        order = numpy.argsort(source)
+        target = numpy.concatenate((high, low))[order].tolist()
+        sourceCell = numpy.concatenate((lowCell, highCell))[order].tolist()
+        targetCell = numpy.concatenate((highCell, lowCell))[order].tolist()
+        spill = numpy.concatenate((spill, spill))[order].tolist()
+        start = numpy.searchsorted(source[order], numpy.arange(self.basins + 1)).tolist()
+
+        level = [math.inf] * self.basins
+        overflow = [-1] * self.basins
+        drained = bytearray(self.basins)
+        level[0] = -math.inf
+        heap = [(-math.inf, 0)]
+        while heap:
+            drainedLevel, current = heapq.heappop(heap)
+            if drained[current]:
+                continue
+            drained[current] = 1
+            for border in range(start[current], start[current + 1]):
+                neighbour = target[border]
+                if drained[neighbour]:
+                    continue
+                neighbourLevel = max(drainedLevel, spill[border])
+                if neighbourLevel < level[neighbour]:
+                    level[neighbour] = neighbourLevel
+                    overflow[neighbour] = border
+                    heapq.heappush(heap, (neighbourLevel, neighbour))
+
+        # the cell each basin overflows at, and where to
+        self.level = numpy.array(level)
+        overflow = numpy.array(overflow, dtype=numpy.int64)
+        self.overflowCell = numpy.array([-1] + targetCell, dtype=numpy.int64)[overflow + 1]
+        self.overflowInto = numpy.array([-1] + sourceCell, dtype=numpy.int64)[overflow + 1]
+
+        basinLevel = self.level[self.basin].reshape(self.worldW, self.worldH)
+        self.filled = numpy.maximum(self.heightmap, basinLevel)
+        self.lakeDepth = self.filled - self.heightmap
+
+    def drainLakes(self):
+        '''Cells under water flow towards the overflow of their basin,
+        spreading out from it through the lake'''
+        direction = self.direction.reshape(-1)
+        basin = self.basin
+        submerged = (self.heightmap.reshape(-1) <= self.level[basin]) & (basin != 0)
+
+        # the overflow cells flow over the border, or off the map
+        cells = self.overflowCell[1:]
+        into = self.overflowInto[1:]
+        offMap = into < 0
+        x, y = numpy.divmod(cells, self.worldH)
+        intoX, intoY = numpy.divmod(numpy.where(offMap, cells, into), self.worldH)
+        dx = (intoX - x + 1) % self.worldW - 1
+        dy = (intoY - y + 1) % self.worldH - 1
+        direction[cells] = numpy.where(offMap, 0, self.directionOf[dx + 1, dy + 1])
+
+        # then breadth first through the lakes, every cell flows to the one
+        # it was reached from
+        visited = ~submerged
+        visited[cells] = True
+        frontier = cells
+        while len(frontier):
+            reached = []
+            for k in range(1, len(self.directions)):
+                there, valid = self.neighbours(frontier, k)
+                valid &= ~visited[numpy.where(valid, there, 0)]
+                valid &= basin[numpy.where(valid, there, 0)] == basin[frontier]
+                there = there[valid]
+                visited[there] = True
+                direction[there] = self.opposite[k]
+                reached.append(there)
+            frontier = numpy.unique(numpy.concatenate(reached))
+
+    def findReceivers(self):
+        '''Flat index of the cell every cell flows to'''
+        self.receiver = flowReceivers(self.direction, self.directions, self.wrap)
+
+def flowReceivers(direction, directions=DIR_NEIGHBORS_CENTER, wrap=True):
+    '''Flat index of the cell every cell flows to, following direction as an
+    index into directions. Cells without a direction, or flowing off a map
+    that does not wrap, flow to themselves.'''
+    worldW, worldH = direction.shape
+    direction = direction.reshape(-1)
+    receiver = numpy.arange(worldW * worldH, dtype=numpy.int32)
+    for k in range(1, len(directions)):
+        dx, dy = directions[k]
+        flows = numpy.flatnonzero(direction == k)
+        x, y = numpy.divmod(flows, worldH)
+        x += dx
+        y += dy
+        if not wrap:
+            valid = (x >= 0) & (x < worldW) & (y >= 0) & (y < worldH)
+            flows, x, y = flows[valid], x[valid], y[valid]
+        receiver[flows] = (x % worldW) * worldH + y % worldH
+    return receiver
+
+def accumulateFlow(receiver, weight):
+    '''Total weight of every cell and all the cells upstream of it. Cells are
+    visited in topological order, a frontier at a time: a cell joins the
+    frontier once all the cells flowing into it have passed their flow on.
+    The flow must be free of cycles.'''
+    flow = numpy.array(weight, dtype=numpy.float64).reshape(-1)
+    cells = numpy.arange(len(flow), dtype=numpy.int32)
+    flows = receiver != cells
+    inflow = numpy.bincount(receiver[flows], minlength=len(flow))
+    frontier = numpy.flatnonzero((inflow == 0) & flows)
+    while len(frontier):
+        downstream = receiver[frontier]
+        numpy.add.at(flow, downstream, flow[frontier])
+        numpy.subtract.at(inflow, downstream, 1)
+        frontier = downstream[(inflow[downstream] == 0) & flows[downstream]]
+        frontier.sort() # cells flowing into the same cell join it only once
+        first = numpy.ones(len(frontier), dtype=bool)
+        first[1:] = frontier[1:] != frontier[:-1]
+        frontier = frontier[first]
+    return flow.reshape(numpy.shape(weight))
+
+if __name__ == '__main__':
+    import sys, time
+    sizes = [int(size) for size in sys.argv[1:]] or [256, 1024, 4096]
+    for size in sizes:
+        # smoothed noise, rough enough to have plenty of pits to fill
+        heightmap = numpy.random.default_rng(1).random((size, size))
+        for step in range(4):
+            heightmap = (heightmap + numpy.roll(heightmap, 1, 0) + numpy.roll(heightmap, 1, 1)) / 3.0
+        for wrap in [True, False]:
+            start = time.time()
+            hydrology = Hydrology(heightmap, 0.45, wrap)
+            hydrology.run()
+            print("%4d wrap %-5s: %.3f seconds, %d basins, %.1f%% under water" % (size, wrap,
+                  time.time() - start, hydrology.basins, 100.0 * (hydrology.lakeDepth > 0).mean()))
+            start = time.time()
+            flow = accumulateFlow(hydrology.receiver, numpy.ones((size, size)))
+            print("%4d wrap %-5s: %.3f seconds to accumulate flow, largest catchment %d" % (size, wrap,
+                  time.time() - start, flow.max()))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Part of the World Generator project.
+
+author:  Bret Curtis
+license: LGPL v2
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+version 2 as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+02110-1301 USA
+"""
+#
+# Generated layers kept on disk, so regenerating a world only reruns the
+# stages whose inputs changed. The layers of a stage are stored under a key
+# digested from everything they were generated from: the layers going in,
+# the parameters of the stage and the seed.
+#
+import os, json, time, shutil, hashlib, numpy
+
+if __name__ == '__main__': # handle multiple entry points
+    from constants import *
+else:
+    from .constants import *
+
+def digest(data):
+    '''SHA-1 of an array, of its type and shape as well as its contents'''
+    data = numpy.ascontiguousarray(data)
+    sha = hashlib.sha1(('%s %s ' % (data.dtype.str, data.shape)).encode())
+    sha.update(data.reshape(-1).view(numpy.uint8))
+    return sha.hexdigest()
+
+class LayerCache():
+    '''Least recently used layers on disk, within a quota in bytes. Every key
+    is a directory of .npy files, one per layer, which are loaded as copy on
+    write memory maps: only what is used is read, and changes to a layer
+    stay out of the cache.'''
+
+    def __init__(self, directory=None, quota=LAYER_CACHE_QUOTA):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.mapGen', 'cache')
+        self.directory = directory
+        self.quota = quota
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, stage, inputs, parameters):
+        '''Key of the layers stage generates from the input arrays and a dict
+        of parameters'''
+        sha = hashlib.sha1(('%d %s ' % (LAYER_CACHE_VERSION, stage)).encode())
+        sha.update(json.dumps(parameters, sort_keys=True, default=lambda value: value.item()).encode())
+        for data in inputs:
+            sha.update(digest(data).encode())
+        return sha.hexdigest()
+
+    def fetch(self, stage, inputs, parameters, generate):
+        '''The layers of stage from the cache, or else those generate returns,
+        a dict of arrays by name, which are then stored'''
+        key = self.key(stage, inputs, parameters)
+        layers = self.load(key)
+        if layers is None:
+            layers = generate()
+            self.store(key, layers)
+        return layers
+
+    def load(self, key):
+        '''The layers stored under key by name, None if there are none'''
+        entry = os.path.join(self.directory, key)
+        try:
+            layers = {}
+            for name in os.listdir(entry):
+                layers[os.path.splitext(name)[0]] = numpy.load(os.path.join(entry, name), mmap_mode='c')
+            os.utime(entry, None) # now most recently used
+        except OSError: # not cached, or evicted meanwhile
+            return None
+        return layers
+
+    def store(self, key, layers):
+        '''Store layers, a dict of arrays by name, under key'''
+        entry = os.path.join(self.directory, key)
+        partial = '%s.%d.partial' % (entry, os.getpid())
+        shutil.rmtree(partial, ignore_errors=True) # left behind by a crash
+        os.makedirs(partial)
+        for name, data in layers.items():
+            numpy.save(os.path.join(partial, name + '.npy'), data)
+        try:
+            os.rename(partial, entry) # at once, a half written entry is never seen
+        except OSError: # stored by another process meanwhile
+            shutil.rmtree(partial, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache fits in its
+        quota, and the partial ones any process left behind by crashing'''
+        entries = []
+        total = 0
+        stale = time.time() - LAYER_CACHE_PARTIAL_AGE
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                used = os.path.getmtime(entry)
+            except OSError: # evicted by another process meanwhile
+                continue
+            if not key.endswith('.partial'):
+                entries.append((used, size, entry))
+            elif used < stale: # left behind by a crash
+                shutil.rmtree(entry, ignore_errors=True)
+                continue
+            total += size # still being written counts too
+
+        entries.sort()
+        for used, size, entry in entries:
+            if total <= self.quota:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+
+if __name__ == '__main__':
+    import sys, tempfile
+    sizes = [int(size) for size in sys.argv[1:]] or [1024, 4096]
+    cache = LayerCache(tempfile.mkdtemp())
+    for size in sizes:
+        data = numpy.random.random((size, size))
+        start = time.time()
+        key = cache.key('benchmark', [data], {'size': size})
+        print("key   %4d: %.3f seconds" % (size, time.time() - start))
+        start = time.time()
+        layers = cache.fetch('benchmark', [data], {'size': size}, lambda: {'data': data})
+        print("miss  %4d: %.3f seconds" % (size, time.time() - start))
+        start = time.time()
+        layers = cache.fetch('benchmark', [data], {'size': size}, lambda: {'data': data})
+        print("hit   %4d: %.3f seconds, same data: %s" % (size, time.time() - start,
+              numpy.array_equal(layers['data'], data)))
+    partial = os.path.join(cache.directory, 'crashed.1.partial')
+    os.makedirs(partial)
+    numpy.save(os.path.join(partial, 'data.npy'), data)
+    os.utime(partial, (0, 0))
+    cache.evict()
+    print("partial entry left by a crash evicted: %s" % (not os.path.exists(partial)))
+    cache.quota = 0
+    cache.evict()
+    print("entries left with no quota: %d" % len(os.listdir(cache.directory)))
+    shutil.rmtree(cache.directory)
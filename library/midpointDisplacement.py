@@ -22,13 +22,54 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 import math, random, numpy
 
 class MDA():
-    def __init__( self, size, roughness = 8 ):
+    def __init__( self, size, roughness = 8, seed = None ):
         self.width, self.height = size
         self.size = self.width + self.height
         self.roughness = roughness
         self.heightmap = None
+        self.seed = seed
 
     def run( self ):
+        ''' Subdivide one level at a time over a lattice covering the whole
+        map, each level averages and displaces all of its squares at once '''
+        rng = numpy.random.default_rng( self.seed )
+
+        # power of 2 lattice large enough for our biggest side
+        side = 1
+        while side < max( self.width, self.height ):
+            side *= 2
+        lattice = numpy.zeros( ( side + 1, side + 1 ) )
+        c1, c3, c2, c4 = rng.random( 4 ) # top, bottom, right, left
+        lattice[0, 0] = c1
+        lattice[-1, 0] = c2
+        lattice[-1, -1] = c3
+        lattice[0, -1] = c4
+
+        step = side
+        while step > 1:
+            half = step // 2
+            corners = lattice[::step, ::step]
+            squares = corners.shape[0] - 1
+
+            # average of all the points during displacement
+            maxd = float( half ) / side * self.roughness
+            mid = ( corners[:-1, :-1] + corners[1:, :-1] + corners[:-1, 1:] + corners[1:, 1:] ) / 4
+            mid += ( rng.random( ( squares, squares ) ) - 0.5 ) * maxd
+            lattice[half::step, half::step] = mid
+
+            # midpoint of the edges is the average of its two end points
+            lattice[half::step, ::step] = ( corners[:-1, :] + corners[1:, :] ) / 2
+            lattice[::step, half::step] = ( corners[:, :-1] + corners[:, 1:] ) / 2
+            step = half
+
+        # each cell is the average of its corners, stretched over our map
+        cells = ( lattice[:-1, :-1] + lattice[1:, :-1] + lattice[:-1, 1:] + lattice[1:, 1:] ) / 4
+        xs = ( numpy.arange( self.width ) * side ) // self.width
+        ys = ( numpy.arange( self.height ) * side ) // self.height
+        self.heightmap = cells[numpy.ix_( xs, ys )]
+
+    def runRecursive( self ):
+        ''' The original recursive version, one call per cell '''
         self.heightmap = numpy.zeros( ( self.width, self.height ) ) # reset on run
         c1 = random.random()    # top
         c3 = random.random()    # bottom
@@ -86,3 +127,5 @@ if __name__ == '__main__':
     print("Thinking...")
     import cProfile
     cProfile.run( 'mda.run()' )
+    if size <= 1024: # the recursive version gets very slow beyond this
+        cProfile.run( 'mda.runRecursive()' )
@@ -20,21 +20,94 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 02110-1301 USA
 """
 import numpy 
-from noise.perlin import SimplexNoise
-from noise import snoise2
 
 if __name__ == '__main__': # handle multiple entry points
     import utilities
 else:
     from . import utilities
 
+# gradient directions for 2D gradient noise
+GRADIENTS_X = numpy.array( [1, -1, 1, -1, 1, -1, 0, 0], dtype = numpy.float32 )
+GRADIENTS_Y = numpy.array( [1, 1, -1, -1, 0, 0, 1, -1], dtype = numpy.float32 )
+PERMUTATION_SIZE = 1024
 
 class Perlin():
-    def __init__( self, size ):
+    def __init__( self, size, octaves = 5, persistence = 0.5, lacunarity = 2.0, scale = 256.0, seed = None ):
         self.width, self.height = size
+        self.octaves = octaves
+        self.persistence = persistence
+        self.lacunarity = lacunarity
+        self.scale = scale # size in pixels of the features of the first octave
+        self.seed = seed
         self.heightmap = None
-        
+
     def run( self ):
+        ''' Multi-octave gradient noise, every octave is evaluated over the
+        whole map at once and wraps around on both axes. The noise package is
+        not used even when installed: its pnoise2 takes one call per cell and
+        is an order of magnitude slower than this '''
+        noiseMap = numpy.zeros( ( self.width, self.height ), dtype = numpy.float32 )
+        rng = numpy.random.default_rng( self.seed )
+        perm = rng.permutation( PERMUTATION_SIZE )
+
+        amplitude = 1.0
+        frequency = 1.0 / self.scale
+        for octave in range( self.octaves ):
+            noiseMap += self.gradientNoise( frequency, perm ) * amplitude
+            amplitude *= self.persistence
+            frequency *= self.lacunarity
+
+        self.heightmap = noiseMap.astype( float )
+
+    def gradientNoise( self, frequency, perm ):
+        ''' One octave of gradient noise, the lattice period is rounded to a
+        whole number of cells so that the map tiles '''
+        periodX = max( 1, int( round( self.width * frequency ) ) )
+        periodY = max( 1, int( round( self.height * frequency ) ) )
+
+        # lattice cell and position within the cell, per column and per row
+        x = numpy.arange( self.width, dtype = numpy.float32 ) * ( float( periodX ) / self.width )
+        y = numpy.arange( self.height, dtype = numpy.float32 ) * ( float( periodY ) / self.height )
+        x0 = x.astype( int )
+        y0 = y.astype( int )
+        fx = ( x - x0 )[:, numpy.newaxis]
+        fy = ( y - y0 )[numpy.newaxis, :]
+        x1 = ( x0 + 1 ) % periodX
+        cellHeights = numpy.bincount( y0, minlength = periodY )
+
+        # gradient of every lattice point
+        latticeX = perm[numpy.arange( periodX ) % PERMUTATION_SIZE][:, numpy.newaxis]
+        latticeY = numpy.arange( periodY )[numpy.newaxis, :]
+        lattice = perm[( latticeX + latticeY ) % PERMUTATION_SIZE] & 7
+        gradX = GRADIENTS_X[lattice]
+        gradY = GRADIENTS_Y[lattice]
+
+        # dot products with the left and right lattice points, interpolated
+        # along x while still at lattice resolution along y
+        u = fx * fx * fx * ( fx * ( fx * 6 - 15 ) + 10 ) # quintic fade curve
+        left = gradX[x0] * fx
+        right = gradX[x1] * ( fx - 1 )
+        alongX = left + u * ( right - left )
+        left = gradY[x0]
+        right = gradY[x1]
+        alongY = left + u * ( right - left )
+
+        # columns only change at lattice boundaries so they are expanded
+        # with repeat, the next lattice row down is the same data rolled
+        top = numpy.repeat( alongX, cellHeights, axis = 1 )
+        top += numpy.repeat( alongY, cellHeights, axis = 1 ) * fy
+        bottom = numpy.repeat( numpy.roll( alongX, -1, axis = 1 ), cellHeights, axis = 1 )
+        bottom += numpy.repeat( numpy.roll( alongY, -1, axis = 1 ), cellHeights, axis = 1 ) * ( fy - 1 )
+
+        v = fy * fy * fy * ( fy * ( fy * 6 - 15 ) + 10 )
+        bottom -= top
+        bottom *= v
+        top += bottom
+        return top
+
+    def runSimplex( self ):
+        ''' The original per pixel version, needs the noise package '''
+        from noise.perlin import SimplexNoise
         noiseMap = numpy.zeros((self.width, self.height))
         
         # pure python version
@@ -64,6 +137,8 @@ class Perlin():
 
 # runs the program
 if __name__ == '__main__':
-    perlin = Perlin((512,512))
+    import sys
+    size = int( sys.argv[1] ) if len( sys.argv ) > 1 else 512
+    perlin = Perlin((size,size))
     import cProfile
     cProfile.run( 'perlin.run()' )    
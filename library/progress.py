@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Part of the World Generator project.
+
+author:  Bret Curtis
+license: LGPL v2
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+version 2 as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+02110-1301 USA
+"""
+#
+# Progress reporting for the generation stages. Stages only talk to a
+# Progress object, what is shown (if anything) is up to the adapter.
+#
+
+class Progress():
+    '''Progress of a stage: start with a total, update with values up to the
+    total and finish. Reports nowhere, stages use it when given nothing.'''
+
+    def start(self, total):
+        pass
+
+    def update(self, value):
+        pass
+
+    def finish(self):
+        pass
+
+class StatusBarProgress(Progress):
+    '''Shows progress as a QProgressBar in a Qt status bar'''
+
+    def __init__(self, statusBar):
+        self.statusBar = statusBar
+        self.progressBar = None
+
+    def start(self, total):
+        from PySide import QtGui
+        self.progressBar = QtGui.QProgressBar()
+        self.progressBar.setRange(0, int(total))
+        self.statusBar.addPermanentWidget(self.progressBar)
+        self.progressBar.setValue(0)
+
+    def update(self, value):
+        self.progressBar.setValue(int(value))
+
+    def finish(self):
+        self.statusBar.removeWidget(self.progressBar)
+        self.progressBar = None
+
+if __name__ == '__main__':
+    # import time of the generation stages, each in a fresh interpreter
+    import os, sys, subprocess
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = "import sys, time; s = time.time(); import %s; " \
+             "print('%%8.1f ms  Qt loaded: %%s' %% ((time.time() - s) * 1000, 'PySide' in sys.modules))"
+    for module in ['numpy', 'library.temperature', 'library.weather', 'library.rivers',
+                   'library.biomes', 'library.heightmap', 'library.world']:
+        output = subprocess.check_output([sys.executable, '-c', script % module], cwd=root)
+        print("%-22s %s" % (module, output.decode().strip()))
@@ -19,7 +19,8 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 02110-1301 USA
 """
-from PySide import QtGui
+import numpy
+from collections import OrderedDict
 from PySide.QtGui import QImage
 
 if __name__ == '__main__': # handle multiple entry points
@@ -27,6 +28,102 @@ if __name__ == '__main__': # handle multiple entry points
 else:
     from .constants import *
 
+ALPHA = numpy.uint32( 0xFF000000 ) # opaque, as QImage.Format_RGB32 expects
+
+TRANSPOSE_STRIP = 128 # rows transposed at a time, keeps them in cache
+
+# the world datasets each map type is drawn from
+RENDER_LAYERS = {
+    'heightmap':            ( 'elevation', ),
+    'sealevel':             ( 'elevation', ),
+    'elevation':            ( 'elevation', ),
+    'heatmap':              ( 'temperature', ),
+    'rawheatmap':           ( 'temperature', ),
+    'windmap':              ( 'wind', ),
+    'rainmap':              ( 'rainfall', ),
+    'windandrainmap':       ( 'wind', 'rainfall' ),
+    'drainagemap':          ( 'drainage', ),
+    'rivermap':             ( 'elevation', 'rivers', 'lakes' ),
+    'biomemap':             ( 'biomeColour', ),
+    'erosionmap':           ( 'erosion', ),
+    'erosionappliedmap':    ( 'elevation', 'erosion' ),
+}
+
+def channel( data, scale = 255 ):
+    '''Scale data to a 0-255 colour channel'''
+    value = numpy.empty( data.shape, dtype = numpy.float32 )
+    numpy.multiply( data, scale, out = value, casting = 'unsafe' )
+    numpy.clip( value, 0, 255, out = value )
+    return value.astype( numpy.uint32 )
+
+def rgb( red = None, green = None, blue = None ):
+    '''Pack 0-255 channels into RGB32 pixels, missing channels are 0'''
+    pixels = None
+    for value, shift in ( ( red, 16 ), ( green, 8 ), ( blue, 0 ) ):
+        if value is not None:
+            if shift:
+                value = numpy.left_shift( value, shift, out = value )
+            if pixels is None:
+                pixels = value
+            else:
+                pixels |= value
+    pixels |= ALPHA
+    return pixels
+
+def grey( gValue ):
+    '''RGB32 pixels of a 0-255 grey channel'''
+    gValue *= 0x010101
+    gValue |= ALPHA
+    return gValue
+
+def imageLayout( pixels ):
+    '''Transpose [x, y] pixels into the [y, x] rows of an image, a strip at a
+    time as a transpose of the whole array thrashes the cache'''
+    width, height = pixels.shape
+    rows = numpy.empty( ( height, width ), dtype = numpy.uint32 )
+    for x in range( 0, width, TRANSPOSE_STRIP ):
+        rows[:, x:x + TRANSPOSE_STRIP] = pixels[x:x + TRANSPOSE_STRIP].T
+    return rows
+
+class BufferImage( QImage ):
+    '''A QImage drawn straight from a [y, x] uint32 RGB32 numpy buffer. The
+    array itself is handed over, through the buffer protocol, and lives as
+    long as the image does as QImage does not copy it'''
+
+    def __init__( self, buffer ):
+        self.buffer = numpy.ascontiguousarray( buffer, dtype = numpy.uint32 )
+        height, width = self.buffer.shape
+        QImage.__init__( self, self.buffer, width, height, width * 4, QImage.Format_RGB32 )
+
+class RenderCache():
+    '''Least recently used rendered maps, within a memory budget in bytes'''
+
+    def __init__( self, budget = RENDER_CACHE_BUDGET ):
+        self.budget = budget
+        self.size = 0
+        self.items = OrderedDict()
+
+    def get( self, key ):
+        if key not in self.items:
+            return None
+        self.items[key] = self.items.pop( key ) # now most recently used
+        return self.items[key][0]
+
+    def put( self, key, item, nbytes ):
+        if key in self.items:
+            self.size -= self.items.pop( key )[1]
+        if nbytes > self.budget: # would evict everything and still not fit
+            return
+        while self.size + nbytes > self.budget:
+            _, ( _, evicted ) = self.items.popitem( last = False )
+            self.size -= evicted
+        self.items[key] = ( item, nbytes )
+        self.size += nbytes
+
+    def clear( self ):
+        self.items.clear()
+        self.size = 0
+
 class Render():
     '''Transform the numpy data into a renderable image suitable for screen'''
 
@@ -36,8 +133,7 @@ class Render():
             exec( 'self.' + k + ' = self.world[k]' )
 
         self.width, self.height = self.elevation.shape
-        self.image = QImage( self.width, self.height, QImage.Format_RGB32 )
-        self.image.fill(QtGui.QColor(0,0,0))
+        self.image = None
 
     def hex2rgb( self, hexcolor ):
         r = ( hexcolor >> 16 ) & 0xFF;
@@ -50,122 +146,93 @@ class Render():
         return '#%02x%02x%02x' % rgb
 
     def convert( self, mapType, seaLevel = None ):
+        self.image = BufferImage( self.buffer( mapType, seaLevel ) )
+        return self.image
+
+    def buffer( self, mapType, seaLevel = None ):
+        '''Colour map the data of a map type into RGB32 pixels, laid out [y, x]
+        like the rows of an image'''
         if seaLevel:
             seaLevel /= 100.0 # reduce to 0.0 to 1.0 range
-            
-        background = []
+
         if mapType == "heightmap":
-            heightmap = self.elevation * 255 # convert to greyscale
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = heightmap[x, y]
-                    self.image.setPixel( x, y, QtGui.QColor( gValue, gValue, gValue ).rgb() )
+            pixels = grey( channel( self.elevation ) ) # convert to greyscale
 
         elif mapType == "sealevel":
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    elevation = self.elevation[x, y]
-                    gValue = elevation * 255
-                    if elevation <= seaLevel:
-                        self.image.setPixel( x, y, QtGui.QColor( 0, 0, gValue ).rgb() )
-                    else:
-                        self.image.setPixel( x, y, QtGui.QColor( gValue, gValue, gValue ).rgb() )
+            gValue = channel( self.elevation )
+            pixels = numpy.where( self.elevation <= seaLevel, rgb( blue = gValue.copy() ), grey( gValue ) )
 
         elif mapType == "elevation":
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    elevation = self.elevation[x, y]
-                    if elevation <= seaLevel:
-                        if elevation < seaLevel/4.0:
-                            self.image.setPixel( x, y, COLOR_DEEPSEA )
-                        elif elevation < seaLevel/2.0:
-                            self.image.setPixel( x, y, COLOR_SEA )
-                        else:
-                            self.image.setPixel( x, y, COLOR_BLUE )
-                    else:
-                        if elevation < 0.65:
-                            self.image.setPixel( x, y, COLOR_GRASSLAND )
-                        elif elevation < 0.95:
-                            self.image.setPixel( x, y, COLOR_HILLS )
-                        else:
-                            self.image.setPixel( x, y, COLOR_WHITE )
+            # palette index of every cell: deep sea, sea, shallows, grassland, hills and peaks
+            elevation = self.elevation
+            land = elevation > seaLevel
+            shade = ( elevation >= seaLevel / 4.0 ).view( numpy.uint8 ) + ( elevation >= seaLevel / 2.0 )
+            shade += land
+            shade += land & ( elevation >= 0.65 )
+            shade += land & ( elevation >= 0.95 )
+            palette = numpy.array( [ COLOR_DEEPSEA, COLOR_SEA, COLOR_BLUE,
+                                     COLOR_GRASSLAND, COLOR_HILLS, COLOR_WHITE ], dtype = numpy.uint32 )
+            pixels = numpy.take( palette | ALPHA, shade )
 
         elif mapType == "heatmap":
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = self.temperature[x, y]
-                    self.image.setPixel( x, y, QtGui.QColor( gValue * 255, gValue * 128, ( 1 - gValue ) * 255 ).rgb() )
+            pixels = rgb( channel( self.temperature ), channel( self.temperature, 128 ),
+                          channel( 1 - self.temperature ) )
 
         elif mapType == "rawheatmap":
-            temperature = self.temperature * 255 # convert to greyscale
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = temperature[x, y]
-                    self.image.setPixel( x, y, QtGui.QColor( gValue, gValue, gValue ).rgb() )
+            pixels = grey( channel( self.temperature ) ) # convert to greyscale
 
         elif mapType == 'windmap':
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = self.wind[x, y]
-                    self.image.setPixel( x, y, QtGui.QColor( 0, gValue * 255, 0 ).rgb() )
+            pixels = rgb( green = channel( self.wind ) )
 
         elif mapType == 'rainmap':
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = self.rainfall[x, y]
-                    self.image.setPixel( x, y, QtGui.QColor( gValue * 100, gValue * 100, gValue * 255 ).rgb() )
+            gValue = channel( self.rainfall, 100 )
+            pixels = rgb( gValue, gValue.copy(), channel( self.rainfall ) )
 
         elif mapType == 'windandrainmap':
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    rain = int( 255 * min( self.wind[x, y], 1.0 ) )
-                    wind = int( 255 * min( self.rainfall[x, y], 1.0 ) )
-                    self.image.setPixel( x, y, QtGui.QColor( 0, wind, rain ).rgb() )
+            pixels = rgb( green = channel( self.rainfall ), blue = channel( self.wind ) )
 
         elif mapType == 'drainagemap':
-            drainage = self.drainage * 255 # convert to greyscale
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = drainage[x, y]
-                    self.image.setPixel( x, y, QtGui.QColor( gValue, gValue, gValue ).rgb() )
+            pixels = grey( channel( self.drainage ) ) # convert to greyscale
 
         elif mapType == 'rivermap':
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = self.elevation[x, y] * 255
-                    if self.elevation[x, y] <= seaLevel: 
-                        self.image.setPixel( x, y, QtGui.QColor( 0, 0, gValue ).rgb() )
-                    else:
-                        rgb = QtGui.QColor( gValue, gValue, gValue ).rgb()
-                        if self.rivers[x, y] > 0.0:
-                            rgb = COLOR_COBALT
-                        if self.lakes[x, y] > 0.0:
-                            rgb = COLOR_AZURE
-                        self.image.setPixel( x, y, rgb )
+            gValue = channel( self.elevation )
+            land = self.elevation > seaLevel
+            pixels = numpy.where( land, grey( gValue.copy() ), rgb( blue = gValue ) )
+            pixels[land & ( self.rivers > 0.0 )] = ALPHA | COLOR_COBALT
+            pixels[land & ( self.lakes > 0.0 )] = ALPHA | COLOR_AZURE
 
         elif mapType == 'biomemap':
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    self.image.setPixel( x, y, self.biomeColour[x, y] )
+            pixels = self.biomeColour.astype( numpy.uint32 )
+            pixels |= ALPHA
 
         elif mapType == "erosionmap":
-            erosion = self.erosion * 255 # convert to greyscale
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = erosion[x, y] 
-                    self.image.setPixel( x, y, QtGui.QColor( gValue, gValue, gValue ).rgb() )
+            pixels = grey( channel( self.erosion ) ) # convert to greyscale
 
         elif mapType == "erosionappliedmap":
-            erosion = ( self.elevation - self.erosion ) *  255 # convert to greyscale
-            for x in range( self.width ):
-                for y in range( self.height ):
-                    gValue = erosion[x, y]
-                    self.image.setPixel( x, y, QtGui.QColor( gValue, gValue, gValue ).rgb() )
+            pixels = grey( channel( self.elevation - self.erosion ) ) # convert to greyscale
 
         else: # something bad happened...
             print("did not get a valid map type, check your bindings programmer man!")
-            print(len( background ), background, mapType)
-            from numpy import zeros
-            background = zeros( ( self.width, self.height ), dtype = "int32" )
-
-        return self.image
+            print(mapType)
+            pixels = numpy.zeros( ( self.width, self.height ), dtype = numpy.uint32 )
+            pixels |= ALPHA
+
+        return imageLayout( pixels )
+
+if __name__ == '__main__':
+    import sys, time
+    mapTypes = [ 'heightmap', 'sealevel', 'elevation', 'heatmap', 'rawheatmap', 'windmap',
+                 'rainmap', 'windandrainmap', 'drainagemap', 'rivermap', 'biomemap',
+                 'erosionmap', 'erosionappliedmap' ]
+    size = int( sys.argv[1] ) if len( sys.argv ) > 1 else 4096
+    world = {}
+    for k in [ 'elevation', 'temperature', 'wind', 'rainfall', 'drainage', 'erosion' ]:
+        world[k] = numpy.random.random( ( size, size ) )
+    world['rivers'] = numpy.random.random( ( size, size ) ) > 0.99
+    world['lakes'] = numpy.random.random( ( size, size ) ) > 0.999
+    world['biomeColour'] = numpy.random.randint( 0, 0xFFFFFF, ( size, size ) ).astype( numpy.uint32 )
+    render = Render( world )
+    for mapType in mapTypes:
+        start = time.time()
+        render.convert( mapType, 25 )
+        print( "%-18s %4d: %.3f seconds" % ( mapType, size, time.time() - start ) )
@@ -19,15 +19,18 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 02110-1301 USA
 """
-import math, random, numpy
-from PySide import QtGui
+import math, numpy
 
 if __name__ == '__main__': # handle multiple entry points
     import aStar, utilities
     from constants import *
+    from hydrology import Hydrology, flowReceivers, accumulateFlow
+    from progress import Progress
 else:
     from . import aStar, utilities
     from .constants import *
+    from .hydrology import Hydrology, flowReceivers, accumulateFlow
+    from .progress import Progress
 
 class Rivers():
     '''Generates fresh water sources, rivers and lakes either randomly or with 
@@ -36,13 +39,11 @@ class Rivers():
     def __init__(self):
         pass
 
-    def generate(self, heightmap, seaLevel, rainmap=None, sb=None, wrap=True):
-        if sb:
-            progressValue = 0
-            progress = QtGui.QProgressBar()
-            progress.setRange(0, 5)
-            sb.addPermanentWidget(progress)
-            progress.setValue(0)
+    def generate(self, heightmap, seaLevel, rainmap=None, progress=None, wrap=True, fill=True, seed=None):
+        if progress is None:
+            progress = Progress()
+        progressValue = 0
+        progress.start(5)
         self.heightmap = heightmap.copy()
         self.seaLevel = seaLevel / 100.0 # reduce to 0.0 - 1.0 range
         self.size = list(heightmap.shape)
@@ -54,62 +55,84 @@ class Rivers():
         self.erosionMap = numpy.zeros((self.worldW, self.worldH))
         self.lakeList = []
         self.riverList = []
+        self.riverId = numpy.full((self.worldW, self.worldH), -1, dtype=numpy.int32) # river of each cell, -1 for none
+        self.riverPos = numpy.full((self.worldW, self.worldH), -1, dtype=numpy.int32) # position along that river
         self.rainMap = rainmap
         self.waterFlow = numpy.zeros((self.worldW, self.worldH))
         self.wrap = wrap
+        self.fill = fill # follow the flow of depression filled terrain
+        self.pathFinder = aStar.pathFinder(wrap) # bound to the heightmap on first use
+        self.lakeDepth = numpy.zeros((self.worldW, self.worldH))
+        self.rng = numpy.random.default_rng(seed)
         
         # step one: water flow per cell based on rainfall 
         self.findWaterFlow()
-        if sb:
-            progress.setValue(progressValue)
-            progressValue += 1
+        progress.update(progressValue)
+        progressValue += 1
 
         # step two: find river sources (seeds)
         riverSources = self.riverSources()
-        if sb:
-            progress.setValue(progressValue)
-            progressValue += 1
+        progress.update(progressValue)
+        progressValue += 1
 
         # step three: for each source, find a path to sea
         for source in riverSources:
             river = self.riverFlow(source)
             if len(river) > 0:
-                self.riverList.append(river)
+                rx, ry = numpy.array(river).T
+                river = (rx * self.worldH + ry).astype(numpy.int32) # flat indices of its cells
+                self.commitRiver(river)
                 self.cleanUpFlow(river)
-                rx, ry = river[-1]  # find last cell in river                
-                if (self.heightmap[rx, ry] > self.seaLevel):
-                    self.lakeList.append(river[-1])  # river flowed into a lake         
-        if sb:
-            progress.setValue(progressValue)
-            progressValue += 1
+                rx, ry = divmod(int(river[-1]), self.worldH)  # find last cell in river                
+                if self.heightmap[rx, ry] > self.seaLevel and \
+                    (not self.fill or self.lakeDepth[rx, ry] > 0.0):
+                    self.lakeList.append([rx, ry])  # river flowed into a lake         
+        progress.update(progressValue)
+        progressValue += 1
 
         # step four: simulate erosion and updating river map
+        self.riverErosion(self.riverList)
         for river in self.riverList:
-            self.riverErosion(river)
             self.riverMapUpdate(river)
-        if sb:
-            progress.setValue(progressValue)
-            progressValue += 1
-
-        # step five: rivers with no paths to sea form lakes    
-        for lake in self.lakeList:
-            # print "Found lake at:",lake
-            lx, ly = lake
-            self.lakeMap[lx, ly] = 0.1  # TODO: make this based on rainfall/flow
-            # lakeWater = self.simulateFlood(lake['x'], lake['y'], self.heightmap[lake['x'], lake['y']] + 0.001)
+        progress.update(progressValue)
+        progressValue += 1
+
+        # step five: rivers with no paths to sea form lakes, flooded up to
+        # the level their depression spills over at
+        if self.lakeList and not self.fill:
+            # the cell by cell flow did not fill the depressions, do so now
+            hydrology = Hydrology(heightmap, self.seaLevel, self.wrap)
+            hydrology.run()
+            self.lakeDepth = hydrology.lakeDepth
+        lakeBed = numpy.where(self.lakeDepth > 0.0, self.heightmap, numpy.inf) # under water before erosion
+        flooded = numpy.zeros((self.worldW, self.worldH), dtype=bool)
+        for lx, ly in self.lakeList:
+            if flooded[lx, ly]:  # more than one river ends in this lake
+                continue
+            if self.lakeDepth[lx, ly] <= 0.0:  # not in a depression, nothing to flood
+                continue
+            spill = heightmap[lx, ly] + self.lakeDepth[lx, ly]
+            lake = utilities.floodFill(lakeBed, lx, ly, spill, self.wrap, flooded)
+            self.lakeMap.reshape(-1)[lake] = spill - self.heightmap.reshape(-1)[lake]
         
         # step six: generate an erosion map that gives us the height difference from original heightmap
         self.erosionMap = heightmap - self.heightmap  # erosion is of positive values
         
-        if sb:
-            progress.setValue(progressValue)
-            progressValue += 1
-            sb.removeWidget(progress)
-            del progress
+        progress.update(progressValue)
+        progressValue += 1
+        progress.finish()
         return
 
     def findWaterFlow(self):
         '''Find the flow direction for each cell in heightmap'''
+        if self.fill:
+            # fill the depressions and let the lakes overflow, all at once
+            hydrology = Hydrology(self.heightmap, self.seaLevel, self.wrap)
+            hydrology.run()
+            self.waterPath = hydrology.direction
+            self.lakeDepth = hydrology.lakeDepth
+            return
+
         # iterate through each cell
         for x in range(self.worldW - 1):
             for y in range(self.worldH - 1):
@@ -152,59 +175,52 @@ class Rivers():
                     # print len(sources), sources
                     if sources:
                         # print "Possible sources: ", len(sources)
-                        source = sources[random.randint(0, len(sources))]
+                        source = sources[self.rng.integers(len(sources))]
                         # print "River source: ", source
                         riverSourceList.append(source)
         else:
             # Version 2, with rainfall
-            #  Using the wind and rainfall data, create river 'seeds' by 
-            #     flowing rainfall along paths until a 'flow' threshold is reached
-            #     and we have a beginning of a river... trickle->stream->river->sea
-
-            # step one: Using flow direction, follow the path for each cell
-            #     adding the previous cell's flow to the current cell's flow.
-            # step two: We loop through the water flow map looking for cells 
-            #     above the water flow threshold. These are our river sources and
-            #     we mark them as rivers. While looking, the cells with no
-            #     out-going flow, above water flow threshold and are still 
-            #     above sea level are marked as 'sources'.
-            for x in range(0, self.worldW - 1):
-                for y in range(0, self.worldH - 1):
-                    rainFall = self.rainMap[x, y]
-                    self.waterFlow[x, y] = rainFall
-
-                    if self.waterPath[x, y] == 0:
-                        continue  # ignore cells without flow direction
-                    cx, cy = x, y  # begin with starting location
-                    neighbourSeedFound = False
-                    while not neighbourSeedFound:  # follow flow path to where it may lead
-
-                        # have we found a seed?
-                        if self.heightmap[cx, cy] >= BIOME_ELEVATION_HILLS_LOW and \
-                            self.heightmap[cx, cy] <= BIOME_ELEVATION_MOUNTAIN_LOW and \
-                            self.waterFlow[cx, cy] >= 10.0:
-
-                            # try not to create seeds around other seeds
-                            for seed in riverSourceList:
-                                sx, sy = seed
-                                if utilities.inCircle(9, cx, cy, sx, sy):
-                                    neighbourSeedFound = True
-                            if neighbourSeedFound:
-                                break  # we do not want seeds for neighbors
-
-                            riverSourceList.append([cx, cy])  # river seed
-                            # self.riverMap[cx,cy] = self.waterFlow[cx,cy] #temp: mark it on map to see 'seed'
-                            break
-
-                        # no path means dead end...
-                        if self.waterPath[cx, cy] == 0:
-                            break  # break out of loop
-
-                        # follow path, add water flow from previous cell                            
-                        dx, dy = DIR_NEIGHBORS_CENTER[self.waterPath[cx, cy]]
-                        nx, ny = cx + dx, cy + dy  # calculate next cell
-                        self.waterFlow[nx, ny] += rainFall
-                        cx, cy = nx, ny  # set current cell to next cell 
+            #  Using the wind and rainfall data, create river 'seeds' where the
+            #     accumulated flow of rainfall reaches a 'flow' threshold and we
+            #     have a beginning of a river... trickle->stream->river->sea
+
+            # step one: every cell passes its rainfall and all the water flowing
+            #     into it on to the cell it flows to, in a single topological pass.
+            # step two: cells in the hills above the water flow threshold, that
+            #     no such cell flows into, are where rivers begin. These become
+            #     our sources, as long as they are not too close to another one.
+            receiver = flowReceivers(self.waterPath, DIR_NEIGHBORS_CENTER, self.wrap)
+            self.waterFlow = accumulateFlow(receiver, self.rainMap)
+            riverSourceList = self.riverSeeds(receiver)
+        return riverSourceList
+
+    def riverSeeds(self, receiver, radius=9):
+        '''Cells where the water flow first reaches the river threshold in the
+        hills, skipping those within radius of a seed already found'''
+        height = self.heightmap.reshape(-1)
+        flow = self.waterFlow.reshape(-1)
+        candidate = (height >= BIOME_ELEVATION_HILLS_LOW) & \
+                    (height <= BIOME_ELEVATION_MOUNTAIN_LOW) & (flow >= 10.0)
+        flows = candidate & (receiver != numpy.arange(len(flow)))
+        candidate[receiver[flows]] = False # downstream of another candidate
+
+        # try not to create seeds around other seeds, only looking at the
+        # seeds in the grid squares around a candidate
+        riverSourceList = []
+        grid = {}
+        for cell in numpy.flatnonzero(candidate).tolist():
+            cx, cy = divmod(cell, self.worldH)
+            gx, gy = cx // radius, cy // radius
+            neighbourSeedFound = False
+            for nx in range(gx - 1, gx + 2):
+                for ny in range(gy - 1, gy + 2):
+                    for sx, sy in grid.get((nx, ny), []):
+                        if utilities.inCircle(radius, cx, cy, sx, sy):
+                            neighbourSeedFound = True
+            if neighbourSeedFound:
+                continue
+            grid.setdefault((gx, gy), []).append((cx, cy))
+            riverSourceList.append([cx, cy])  # river seed
         return riverSourceList
 
     def riverFlow(self, source):
@@ -216,7 +232,6 @@ class Rivers():
         # start the flow
         while True:
             x, y = currentLocation
-            lowerElevation = None
             quickSection = None            
             isWrapped = False
 
@@ -224,24 +239,32 @@ class Rivers():
                 ax, ay = x + dx, y + dy
                 if self.wrap:
                     ax, ay = utilities.overflow(ax, self.worldW), utilities.overflow(ay, self.worldH)
-                    
-                for river in self.riverList:
-                    if [ax, ay] in river:
-                        #print "Found another river at:", x, y, " -> ", ax, ay, " Thus, using that river's path."
-                        merge = False
-                        for rx, ry in river:
-                            if [ax, ay] == [rx, ry]:
-                                merge = True
-                                path.append([rx, ry])
-                            elif merge == True:
-                                path.append([rx, ry])
-                        return path  # skip the rest, return path
+                elif utilities.outOfBounds([ax, ay], self.size):
+                    continue
+
+                river = self.riverId[ax, ay]
+                if river >= 0:
+                    #print "Found another river at:", x, y, " -> ", ax, ay, " Thus, using that river's path."
+                    merged = self.riverList[river][self.riverPos[ax, ay]:]
+                    path += numpy.stack(numpy.divmod(merged, self.worldH), axis=1).tolist()
+                    return path  # skip the rest, return path
 
             # found a sea?
             #print "Flowing to...",x,y
             if self.heightmap[x, y] <= self.seaLevel:
                 break
 
+            # follow the precomputed flow, which ends at the sea, the edge of
+            # the map or a lake deep enough to end the river in
+            if self.fill:
+                direction = self.waterPath[x, y]
+                if direction == 0 or self.lakeDepth[x, y] > WGEN_LAKE_MIN_DEPTH:
+                    break
+                dx, dy = DIR_NEIGHBORS_CENTER[direction]
+                currentLocation = [utilities.overflow(x + dx, self.worldW), utilities.overflow(y + dy, self.worldH)]
+                path.append(currentLocation)
+                continue
+
             # find our immediate lowest elevation and flow there
             quickSection = self.findQuickPath(currentLocation)
 
@@ -250,82 +273,19 @@ class Rivers():
                 currentLocation = quickSection
                 continue # stop here and enter back into loop
             
-            isWrapped, lowerElevation = self.findLowerElevation(currentLocation)
-            if lowerElevation and not isWrapped:
-                lowerPath = None                                   
-                lowerPath = aStar.pathFinder().find(self.heightmap, currentLocation, lowerElevation)            
+            isWrapped, lowerElevations = self.findLowerElevation(currentLocation)
+            if lowerElevations:
+                # the search wraps around the edges of the map with us
+                lowerPath = self.pathFinder.findNearest(self.heightmap, currentLocation, lowerElevations)
                 if lowerPath:
                     path += lowerPath
                     currentLocation = path[-1]
-                else:
-                    break
-            elif lowerElevation and isWrapped:
-                #TODO: make this more natural
-                maxRadius = 40
-                wrappedX = wrappedY = False
-#                print 'Found a lower elevation on wrapped path, searching path!'
-#                print 'We go from',currentLocation,'to',lowerElevation
-                cx,cy = currentLocation
-                lx,ly = lowerElevation
-                nx,ny = lowerElevation
-                
-                if (x < 0 or y < 0 or x > self.worldW or y > self.worldH):
-                    print("BUG: fix me... we shouldn't be here:", currentLocation, lowerElevation)
-                    break
-                
-                if not utilities.inCircle(maxRadius, cx, cy, lx, cy):
-                    # are we wrapping on x axis?
-                    #print "We found wrapping along x-axis"
-                    if cx-lx < 0:
-                        lx = 0 # move to left edge
-                        nx = self.worldW-1 # next step is wrapped around
-                    else:
-                        lx = self.worldW-1 # move to right edge
-                        nx = 0 # next step is wrapped around
-                    ly = ny = int( (cy+ly)/2 ) # move halfway
-                elif not utilities.inCircle(maxRadius, cx, cy, cx, ly):
-                    # are we wrapping on y axis?
-#                    print "We found wrapping along y-axis"
-                    if cy-ly < 0:
-                        ly = 0 # move to top edge
-                        ny = self.worldH-1 # next step is wrapped around
-                    else:
-                        ly = self.worldH-1 # move to bottom edge
-                        ny = 0 # next step is wrapped around
-                    lx = nx = int( (cx+lx)/2 ) # move halfway
-                else:
-#                    print "BUG: fix me... we are not in circle:", currentLocation, lowerElevation
-                    break
-                
-                # find our way to the edge
-                edgePath = None  
-                edgePath = aStar.pathFinder().find(self.heightmap, [cx,cy], [lx,ly])
-                if not edgePath:
-#                    print "We've reached the end of this river, we cannot get through."
+                elif isWrapped:
                     # can't find another other path, make it a lake
                     self.lakeList.append(currentLocation)
                     break
-                path += edgePath # add our newly found path
-                path.append([nx,ny]) # finally add our overflow to other side
-                currentLocation = path[-1]
-#                print "Path found from ", [cx,cy], 'to', [lx,ly], 'via:'
-#                print edgePath
-#                print "We then wrap on: ", [nx, ny]
-                
-                # find our way to lowest position original found
-                lowerPath = aStar.pathFinder().find(self.heightmap, currentLocation, lowerElevation)
-                path += lowerPath
-                currentLocation = path[-1]
-#                print "We then go to our destination: ", lowerElevation
-#                print lowerPath
-#                print " "                    
-#                print "Full path begin and end ", path[0], path[-1]
-                hx,hy = path[0]
-                hlx,hly = path[-1]
-#                print "Elevations: ", self.heightmap[hx,hy], self.heightmap[hlx,hly]
-#                print "Erosion: ", self.erosionMap[hx,hy], self.erosionMap[hlx,hly]
-#                print " "
-                #break
+                else:
+                    break
             else: # can't find any other path, make it a lake
                 self.lakeList.append(currentLocation)
                 break # end of river
@@ -335,82 +295,93 @@ class Rivers():
 
         return path
 
+    def commitRiver(self, river):
+        '''Add a river, as the flat indices of its cells, to the river list
+        and index its cells, cells already part of an earlier river stay
+        with it'''
+        cells = river[::-1] # first visit to a cell is written last
+        position = numpy.arange(len(river) - 1, -1, -1, dtype=numpy.int32)
+        unclaimed = self.riverId.reshape(-1)[cells] < 0
+        cells = cells[unclaimed]
+        self.riverId.reshape(-1)[cells] = len(self.riverList)
+        self.riverPos.reshape(-1)[cells] = position[unclaimed]
+        self.riverList.append(river)
+
     def cleanUpFlow(self, river):
         '''Validate that for each point in river is equal to or lower than the
         last'''
-        celevation = 1.0
-        for r in river:
-            rx, ry = r
-            relevation = self.heightmap[rx, ry]
-            if relevation <= celevation:
-                celevation = relevation
-            elif relevation > celevation:
-                self.heightmap[rx, ry] = celevation
+        heightmap = self.heightmap.reshape(-1)
+        heightmap[river] = numpy.minimum.accumulate(numpy.minimum(heightmap[river], 1.0))
         return river
 
-
-    def riverErosion(self, river):
-        '''Simulate erosion in heightmap based on river path.
+    def riverErosion(self, rivers):
+        '''Simulate erosion in heightmap based on river paths.
             * current location must be equal to or less than previous location
             * riverbed is carved out by % of volume/flow
             * sides of river are also eroded to slope into riverbed.
             '''
-        # erosion of riverbed itself
-        maxElevation = 1.0
-        minElevation = 0.0
-        for r in river:
-            rx, ry = r
-            if self.heightmap[rx, ry] < maxElevation:
-                maxElevation = self.heightmap[rx, ry]
-            minElevation = maxElevation * 0.99
-            maxElevation = random.uniform(minElevation, maxElevation)
-            self.heightmap[rx, ry] = maxElevation
-
-        # erosion around river, create river valley
-        for r in river:
-            rx, ry = r
-            radius = 2
-            for x in range(rx - radius, rx + radius):
-                for y in range(ry - radius, ry + radius):
-                    if not self.wrap and utilities.outOfBounds([x, y], self.size):  # ignore edges of map
-                        continue
-                    x, y = utilities.overflow(x, self.worldW), utilities.overflow(y, self.worldH)
-                    curve = 1.0
-                    if [x, y] == [0, 0]:  # ignore center
-                        continue
-                    if [x, y] in river:  # ignore river itself
-                        continue
-                    if self.heightmap[x, y] <= self.heightmap[rx, ry]:  # ignore areas lower than river itself
-                        continue
-                    if not utilities.inCircle(radius, rx, ry, x, y):  # ignore things outside a circle
-                        continue
-
-                    adx, ady = math.fabs(rx - x), math.fabs(ry - y)
-                    if adx == 1 or ady == 1:
-                        curve = 0.2
-                    elif adx == 2 or ady == 2:
-                        curve = 0.05
-
-                    diff = self.heightmap[rx, ry] - self.heightmap[x, y]
-                    newElevation = self.heightmap[x, y] + (diff * curve)
-                    if newElevation <= self.heightmap[rx, ry]:
-                        print('newElevation is <= than river, fix me...')
-                        newElevation = self.heightmap[x, y]
-                    self.heightmap[x, y] = newElevation
+        # erosion of riverbed itself: each cell drops to between 99% and 100%
+        # of the lowest of itself and the cell before, which unrolls to the
+        # lowest of every earlier cell scaled by the drops since
+        for river in rivers:
+            rx, ry = numpy.divmod(river, self.worldH)
+            drop = numpy.log(0.99 + 0.01 * self.rng.random(len(river)))
+            dropped = numpy.cumsum(drop)
+            with numpy.errstate(divide='ignore'):
+                elevation = numpy.log(numpy.minimum(self.heightmap[rx, ry], 1.0)) - dropped + drop
+            self.heightmap[rx, ry] = numpy.exp(numpy.minimum.accumulate(elevation) + dropped)
+
+        # erosion around rivers, create river valleys; each river cell pulls
+        # its neighbours a share (curve) of the way down to its bed. A cell
+        # pulled several times ends up the product of what it kept above
+        # the (curve weighted) mean of those beds, and never below the
+        # lowest of them.
+        if not rivers:
+            return
+        rx, ry = numpy.divmod(numpy.concatenate(rivers), self.worldH)
+        riverbed = self.heightmap[rx, ry]
+        size = self.worldW * self.worldH
+        kept = numpy.zeros(size) # log of the share of height kept
+        pull = numpy.zeros(size)
+        pulledTo = numpy.zeros(size)
+        lowestBed = numpy.full(size, numpy.inf)
+        radius = 2
+        for dx in range(-radius, radius):
+            for dy in range(-radius, radius):
+                if dx == 0 and dy == 0 or not utilities.inCircle(radius, 0, 0, dx, dy):
+                    continue
+                if abs(dx) == 1 or abs(dy) == 1:
+                    curve = 0.2
+                else:
+                    curve = 0.05
+                x, y, bed = rx + dx, ry + dy, riverbed
+                if not self.wrap:  # ignore edges of map
+                    inside = (x >= 0) & (x < self.worldW) & (y >= 0) & (y < self.worldH)
+                    x, y, bed = x[inside], y[inside], bed[inside]
+                x, y = x % self.worldW, y % self.worldH
+
+                # ignore rivers themselves and areas lower than the river
+                valley = (self.riverId[x, y] < 0) & (self.heightmap[x, y] > bed)
+                cell, bed = x[valley] * self.worldH + y[valley], bed[valley]
+                numpy.add.at(kept, cell, math.log(1.0 - curve))
+                numpy.add.at(pull, cell, curve)
+                numpy.add.at(pulledTo, cell, curve * bed)
+                numpy.minimum.at(lowestBed, cell, bed)
+
+        cell = numpy.flatnonzero(pull)
+        kept = numpy.exp(kept[cell])
+        bed = pulledTo[cell] / pull[cell]
+        heightmap = self.heightmap.reshape(-1)
+        newElevation = heightmap[cell] * kept + bed * (1.0 - kept)
+        heightmap[cell] = numpy.maximum(newElevation, lowestBed[cell])
         return
 
     def riverMapUpdate(self, river):
         '''Update the rivermap with the rainfall that is to become the waterflow'''
-        isSeed = True
-        px, py = (0, 0)
-        for x, y in river:
-            if isSeed:
-                self.riverMap[x, y] = self.waterFlow[x, y]
-                isSeed = False
-            else:
-                self.riverMap[x, y] = self.rainMap[x, y] + self.riverMap[px, py]
-            px, py = x, y
-
+        # the seed starts with its water flow, every cell after adds its rain
+        flow = self.rainMap.reshape(-1)[river]
+        flow[0] = self.waterFlow.reshape(-1)[river[0]]
+        self.riverMap.reshape(-1)[river] = numpy.cumsum(flow)
 
     def findQuickPath(self, river):
         # Water flows based on cost, seeking the highest elevation difference
@@ -450,165 +421,25 @@ class Rivers():
         return newPath
 
     def findLowerElevation(self, source):
-        '''Try to find a lower elevation with in a range of an increasing
-        circle's radius and try to find the best path and return it'''
+        '''Try to find lower elevations with in a range of an increasing
+        circle's radius, returning all of those in the first circle that has
+        any so the path finder can head for the nearest'''
         x, y = source
-        currentRadius = 1
         maxRadius = 40
-        lowestElevation = self.heightmap[x, y]
-        destination = []
-        notFound = True
-        isWrapped = False
-        wrapped = []
-
-        while notFound and currentRadius <= maxRadius:
-            for cx in range(-currentRadius, currentRadius + 1):
-                for cy in range(-currentRadius, currentRadius + 1):
-                    rx, ry = x + cx, y + cy
-                    
-                    # are we within bounds?
-                    if not self.wrap and utilities.outOfBounds([rx, ry], self.size):
-                        continue     
-
-                    # are we within a circle?
-                    if not utilities.inCircle(currentRadius, x, y, rx, ry):
-                        continue
-                    
-                    rx, ry = utilities.overflow(rx, self.worldW), utilities.overflow(ry, self.worldH)
-
-#                    if utilities.outOfBounds([x+cx, y+cy], self.size):
-#                        print "Fixed:",x ,y,  rx, ry
-
-                    elevation = self.heightmap[rx, ry]
-                    if elevation < lowestElevation: # have we found a lower elevation?
-                        lowestElevation = elevation
-                        destination = [rx, ry]
-                        notFound = False
-                        if utilities.outOfBounds([x+cx, y+cy], self.size):
-                            wrapped.append(destination)                        
-
-            currentRadius += 1
-            
-        if destination in wrapped:
-            isWrapped = True
-#            print "Wrapped lower elevation found:", rx, ry, "!"
-        return isWrapped, destination
-    
-#### experimental code ####
-    def simulateFloodi(self, x, y, elevation):
-        '''Flood fill area based on elevation.
-        The recursive algorithm. Starting at x and y, changes and marks any
-        adjacent area that is under the elevation.'''
-
-        # are we in bounds of world
-        if utilities.outOfBounds({'x': x, 'y': y}, self.size):
-            return
-
-        # Base case. If the current [x, y] elevation is greater then do nothing.
-        if self.heightmap[x, y] > elevation:
-            return
-
-        # Flood area and mark on map
-        self.lakeMap[x, y] = 1
-        print('lake at: ', x, y)
-
-        # Recursive calls.
-        self.simulateFlood(x - 1, y, elevation)  # left
-        self.simulateFlood(x, y - 1, elevation)  # up
-        self.simulateFlood(x + 1, y, elevation)  # right
-        self.simulateFlood(x, y + 1, elevation)  # down
-
-    def simulateFlood(self, x, y, elevation):
-        '''Flood fill area based on elevation.
-        The iterative algorithm. Starting at x and y, changes and marks any
-        adjacent area that is under the elevation.'''
-
-        theStack = [(x, y)]
-
-        while len(theStack) > 0:
-            x, y = theStack.pop()
-
-            # are we in bounds of world
-            if utilities.outOfBounds({'x': x, 'y': y}, self.size):
-                continue
-
-            # Base case. If the current [x, y] elevation is greater then do nothing.
-            if self.heightmap[x, y] > elevation:
-                continue
-
-            # Flood area and mark on map
-            self.lakeMap[x, y] = 1
-            print('lake at: ', x, y)
-
-            theStack.append((x - 1, y))  # left
-            theStack.append((x, y - 1))  # up
-            theStack.append((x + 1, y))  # right
-            theStack.append((x, y + 1))  # down
-
-
-
-    def isRiverNearby(self, radius, tryX, tryY):
-        ''' return true if there is a river in the range of radius from
-        source '''
-        for x in range(-radius, radius + 1):
-            for y in range(-radius, radius + 1):
-
-                # are we within bounds?
-                if utilities.outOfBounds({'x': tryX + x, 'y': tryY + y}, self.size):
-                    continue
-
-                # are we within a circle?
-                if not utilities.inCircle(radius, tryX, tryY, tryX + x, tryY + y):
-                    continue
-
-                # found a river?
-                if self.riverMap[tryX + x, tryY + y] > 0.0:
-                    return True
-
-        # no river found
-        return False
-
-    def findClosestSea(self, river):
-        '''Try to find the closest sea by avoiding watersheds, the returned
-        value should be a point in sea itself '''
-
-        radius = 1
-        while radius < self.worldW:
-
-            for x in range(-radius, radius + 1):
-                for y in range(-radius, radius + 1):
-                    # verify that we do not go over the edge of map
-                    if river.x + x >= 0 and river.y + y >= 0 and \
-                    river.x + x < self.worldW and river.y + y < self.worldH:
-
-                        # check that we are in circle
-                        if not self.in_circle(river.x, river.y, radius, river.x + x, river.y + y):
-                            continue
-
-                        elevation = self.heightmap[river.x + x, river.y + y]
-                        # if elevation > BIOME_ELEVATION_MOUNTAIN:
-                        #     break # we hit the watershed, do not continue
-
-                        if elevation < self.seaLevel:
-                            # possible sea, lets check it out...
-                            # is the spot surrounded by sea?
-                            isSea = True
-                            seaRange = 4
-                            for i in range(-seaRange, seaRange + 1):
-                                for j in range(-seaRange, seaRange + 1):
-                                    if river.x + x + i >= 0 and river.y + y + j >= 0 and \
-                                    river.x + x + i < self.worldW and river.y + y + j < self.worldH:
-                                        if self.heightmap[river.x + x + i, river.y + y + j] > self.seaLevel:
-                                            isSea = False
-
-                            if isSea:
-                                print("River at source:", river.x, river.y, " found the sea at: ", river.x + x, river.y + y)
-                                return {'x': river.x + x, 'y': river.y + y}
-
-            radius += 1  # increase searchable area
-
-        print("Could not find sea.")
-        return {}
+        dx, dy, ring = utilities.discOffsets(maxRadius)
+        rx, ry = x + dx, y + dy
+        isOutside = (rx < 0) | (rx >= self.worldW) | (ry < 0) | (ry >= self.worldH)
+        rx, ry = rx % self.worldW, ry % self.worldH
+        isLower = self.heightmap[rx, ry] < self.heightmap[x, y]
+        if not self.wrap:
+            isLower &= ~isOutside
+        if not isLower.any():
+            return False, []
+
+        # the offsets are sorted by circle, the first lower one is in the smallest
+        isLower &= ring == ring[numpy.argmax(isLower)]
+        isWrapped = bool(isOutside[isLower].any())
+        return isWrapped, numpy.stack((rx[isLower], ry[isLower]), axis=1).tolist()
 
 if __name__ == '__main__':
     print("hello!")
@@ -26,13 +26,13 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 # Original code written by Shea Kauffman based on work by Hugo Elias
 # Refactored and modified to to be generic by Bret Curtis
 
-from PIL import Image, ImageDraw, ImageChops, ImageOps, ImageFilter
 import random, math, numpy
 
 class Sphere():
-    def __init__( self, size, roughness ):
+    def __init__( self, size, roughness, seed = None, cutsPerPass = 32 ):
             self.percentWater = .70
-            self.mapSize = size[0] #width (same as height) in pixels
+            self.width, self.height = size
+            self.mapSize = size[0] #width (same as height) in pixels, used by the image version
             self.maxSize = 1.40 # 1 to 5 How big should the slices be cut, smaller slices create more islands
             self.shape = 1.40 # 1 has round continents .5 is twice as tall as it is wide, 2.0 is twice as wide as tall
             self.driftRate = .70 # As the world ages how much slower does it drift. 1 creates a more textured world but takes longer
@@ -41,13 +41,98 @@ class Sphere():
             self.randType = random.uniform #change to alter variability
             self.xrand = lambda ms = self.mapSize * 3: int( self.randType( 0, ms ) )
             self.yrand = lambda ms = self.mapSize * 2: int( self.randType( 0 - ( ms / 2 ), ms ) )
+            self.seed = seed
+            self.cutsPerPass = cutsPerPass # cuts drawn between checks of the extrema
+
+    def run( self ):
+        ''' Cut ovals into a float array, several cuts are rasterized at once
+        as row spans and summed in a single pass '''
+        rng = numpy.random.default_rng( self.seed )
+        sphere = numpy.empty( ( self.width, self.height ) )
+        sphere.fill( 256 * ( 1.0 - ( self.percentWater ) ) )
+        spans = numpy.empty( ( self.width + 1, self.height ) ) # reused for every pass
+        extrema = self.highestPoint( sphere )
+        while extrema > self.driftRate / ( self.roughness * 10 * self.maxSize ):
+            self.cutOvals( sphere, spans, rng, extrema )
+            extrema = self.highestPoint( sphere )
+
+        self.heightmap = self.normalizeArray( sphere ) / 100
+
+    def highestPoint( self, sphere ):
+        return sphere.min() / 255.0 if self.percentWater > .5 else 1 - ( sphere.max() / 255.0 )
+
+    def cutOvals( self, sphere, spans, rng, smallness ):
+        ''' Raise or lower a batch of ovals, the x axis wraps around at twice
+        the width of the map '''
+        cuts = self.cutsPerPass
+        smallness = smallness ** self.driftRate
+        wrap = self.width * 2
+
+        # land or sea and by how much
+        isSea = rng.random( cuts ) < self.percentWater
+        share = numpy.where( isSea, 1.0 - self.percentWater, self.percentWater )
+        amount = numpy.ceil( 1 + rng.random( cuts ) * ( self.roughness * smallness * share - 1 ) )
+        amount[isSea] *= -1
+
+        # bounding box of each oval
+        x0 = rng.uniform( 0, wrap, cuts )
+        y0 = rng.uniform( 0 - self.height / 2.0, self.height, cuts )
+        radiusX = ( self.width * self.maxSize * self.shape ) * smallness / 2
+        radiusY = ( self.height * self.maxSize ) * smallness / 2
+        centerX = x0 + radiusX
+        centerY = y0 + radiusY
+
+        # every row covered by each oval
+        top = numpy.clip( numpy.ceil( centerY - radiusY - 0.5 ), 0, self.height ).astype( int )
+        bottom = numpy.clip( numpy.floor( centerY + radiusY - 0.5 ) + 1, 0, self.height ).astype( int )
+        rows = numpy.maximum( bottom - top, 0 )
+        cut = numpy.repeat( numpy.arange( cuts ), rows )
+        y = numpy.arange( rows.sum() ) - numpy.repeat( numpy.cumsum( rows ) - rows, rows ) + top[cut]
+
+        # horizontal extent of the oval on each row
+        dy = ( y + 0.5 - centerY[cut] ) / radiusY
+        halfWidth = radiusX * numpy.sqrt( numpy.maximum( 1.0 - dy * dy, 0.0 ) )
+        left = numpy.ceil( centerX[cut] - halfWidth - 0.5 ).astype( int )
+        right = numpy.floor( centerX[cut] + halfWidth - 0.5 ).astype( int )
+        shift = ( left // wrap ) * wrap
+        left -= shift
+        right -= shift
+
+        # spans that cross the wrap continue from the left edge
+        spans.fill( 0.0 )
+        value = amount[cut]
+        for start, end in ( ( left, numpy.minimum( right, wrap - 1 ) ), ( left * 0, right - wrap ) ):
+            visible = ( start < self.width ) & ( end >= start )
+            end = numpy.minimum( end, self.width - 1 )
+            numpy.add.at( spans, ( start[visible], y[visible] ), value[visible] )
+            numpy.add.at( spans, ( end[visible] + 1, y[visible] ), -value[visible] )
+        numpy.cumsum( spans, axis = 0, out = spans )
+        sphere += spans[:-1]
+        numpy.clip( sphere, 0, 255, out = sphere )
+
+    def normalizeArray( self, sphere ):
+        ''' Same as normalizeImage, but on floats: blur, blend with an
+        equalized copy and multiply with itself '''
+        padded = numpy.pad( sphere, 2, mode = 'edge' )
+        blurred = numpy.zeros( sphere.shape )
+        for dx in range( 5 ): # ImageFilter.BLUR, the outer ring of a 5x5 kernel
+            for dy in range( 5 ):
+                if dx in ( 0, 4 ) or dy in ( 0, 4 ):
+                    blurred += padded[dx:dx + self.width, dy:dy + self.height]
+        blurred /= 16.0
+        ordered = numpy.sort( blurred, axis = None )
+        equalized = numpy.searchsorted( ordered, blurred, side = 'right' ) * ( 255.0 / ordered.size )
+        picture = ( equalized + blurred ) * 0.5
+        return picture * picture / 255.0
 
     def normalizeImage( self, image ):
+        from PIL import ImageChops, ImageOps, ImageFilter
         image = image.filter( ImageFilter.BLUR )
         picture = ImageChops.blend( ImageOps.equalize( image ), image, .5 )
         return ImageChops.multiply( picture, picture )
 
     def drawPieSlices( self, oval, orig, action ):
+        from PIL import Image, ImageDraw
         fl = action[1]
         img = Image.new( 'L', ( self.mapSize * 2, self.mapSize ) )
         draw = ImageDraw.Draw( img )
@@ -61,6 +146,7 @@ class Sphere():
         return action[0]( orig, img )
 
     def drawOval( self, oval, orig, action ):
+        from PIL import Image, ImageDraw
         img = Image.new( 'L', ( self.mapSize * 2, self.mapSize ) )
         draw = ImageDraw.Draw( img )
         draw.ellipse( oval, fill = action[1] )
@@ -68,6 +154,7 @@ class Sphere():
         return action[0]( orig, img )
 
     def cutOval( self, orig, smallness = 1 ):
+        from PIL import ImageChops
         smallness = smallness ** self.driftRate
         landAction = lambda: ( 
             ImageChops.add,
@@ -92,14 +179,16 @@ class Sphere():
         return ex / 255.0 if self.percentWater > .5 else 1 - ( ey / 255.0 )
 
     def createSphere( self ):
+        from PIL import Image, ImageDraw
         sphere = Image.new( 'L', ( self.mapSize, self.mapSize ) )
         img = ImageDraw.Draw( sphere )
         baseline = ( 256 * ( 1.0 - ( self.percentWater ) ) )
-        img.rectangle( [0 - self.mapSize, 0, self.mapSize * 4, self.mapSize], fill = baseline )
+        img.rectangle( [0 - self.mapSize, 0, self.mapSize * 4, self.mapSize], fill = int( baseline ) )
         del img
         return sphere
 
-    def run( self ):
+    def runImage( self ):
+        ''' The original version, every cut is drawn into new PIL images '''
         sphere = self.createSphere()
         extrema = self.highestPointOnSphere( sphere )
         while extrema > self.driftRate / ( self.roughness * 10 * self.maxSize ):
@@ -115,4 +204,5 @@ if __name__ == '__main__':
     sphere = Sphere((512,512),1)
     import cProfile
     cProfile.run( 'sphere.run()' )
+    cProfile.run( 'sphere.runImage()' )
 
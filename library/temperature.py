@@ -21,15 +21,16 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 """
 
 import math, random, numpy
-from PySide import QtGui
     
 if __name__ == '__main__': # handle multiple entry points
     from constants import *
+    from progress import Progress
 else:
     from .constants import *     
+    from .progress import Progress
 
 class Temperature():
-    def __init__( self, heightmap, seaLevel, hemisphere = WGEN_HEMISPHERE_EQUATOR, resolution = TEMPERATURE_BAND_RESOLUTION):
+    def __init__( self, heightmap, seaLevel, hemisphere = WGEN_HEMISPHERE_EQUATOR, resolution = TEMPERATURE_BAND_RESOLUTION, seed = None ):
         self.heightmap = heightmap
         self.hemisphere = hemisphere
         self.resolution = resolution
@@ -37,20 +38,83 @@ class Temperature():
         self.worldH = len( self.heightmap[0] )
         self.temperature = numpy.zeros( ( self.worldW, self.worldH ) )
         self.seaLevel = seaLevel / 100.0 # reduce to 0.0 - 1.0 range
+        self.rng = numpy.random.default_rng( seed )
 
-    def run( self, sb = None ):
+    def run( self, progress = None ):
         # setup or local variables
-        if sb != None:
-            progressValue = 0
-            progress = QtGui.QProgressBar()
-            progress.setRange( 0, self.worldH / self.resolution )
-            sb.addPermanentWidget( progress )
-            progress.setValue( 0 )
+        if progress is None:
+            progress = Progress()
+        progress.start( 3 )
+        bands = numpy.arange( 0, self.worldH, self.resolution )
+
+        # temperature of each band
+        if self.hemisphere == WGEN_HEMISPHERE_NORTH:
+                # 0, 0.5, 1
+                bandtemp = bands / float( self.worldH )
+        elif self.hemisphere == WGEN_HEMISPHERE_EQUATOR:
+                # 0, 1, 0
+                bandtemp = numpy.where( bands < ( self.worldH / 2 ), bands / float( self.worldH ), 1.0 - bands / float( self.worldH ) )
+                bandtemp *= 2.0
+        elif self.hemisphere == WGEN_HEMISPHERE_SOUTH:
+                # 1, 0.5, 0
+                bandtemp = 1.0 - bands / float( self.worldH )
+        else:
+            print("Whoops: no hemisphere chosen.")
+            exit()
+        bandtemp = numpy.maximum( bandtemp, 0.075 )
+
+        # wavy boundary of every band, a random walk along x for all bands at once
+        bandrange = 7
+        direction = numpy.ones( len( bands ) )
+        diradj = numpy.ones( len( bands ) )
+        dirsin = self.rng.integers( 1, 9, len( bands ) )
+        boundary = numpy.empty( ( self.worldW, len( bands ) ) )
+        for x in range( self.worldW ):
+            if x % 256 == 0: # draw the random steps a few columns at a time
+                uniform = self.rng.random( ( 256, len( bands ) ) )
+            boundary[x] = direction
+            step = numpy.sin( dirsin * x )
+            step *= diradj
+            step *= uniform[x % 256]
+            direction += step
+            turn = numpy.flatnonzero( numpy.abs( direction ) > bandrange )
+            if len( turn ):
+                diradj[turn] = -numpy.sign( direction[turn] )
+                dirsin[turn] = self.rng.integers( 1, 9, len( turn ) )
+        boundary += bands
+        progress.update( 1 )
+
+        # each band covers the cells below its boundary, up to the next band
+        # covering them: the last band starting at or above a cell is its band
+        start = numpy.clip( boundary.astype( int ) + 1, 0, self.worldH )
+        band = numpy.full( ( self.worldW, self.worldH + 1 ), -1, dtype = numpy.int32 )
+        cells = numpy.arange( self.worldW )[:, numpy.newaxis] * ( self.worldH + 1 ) + start
+        numpy.maximum.at( band.reshape( -1 ), cells.reshape( -1 ),
+                          numpy.broadcast_to( numpy.arange( len( bands ), dtype = numpy.int32 ), cells.shape ).reshape( -1 ) )
+        numpy.maximum.accumulate( band, axis = 1, out = band )
+        del start, cells
+        progress.update( 2 )
+
+        # typical temp at sea level and at elevation, cells without a band stay 0
+        self.temperature = numpy.take( numpy.append( bandtemp, 0.0 ), band[:, :self.worldH] )
+        lapse = numpy.subtract( 1.0 + self.seaLevel, self.heightmap )
+        numpy.copyto( lapse, 0.7, where = self.heightmap <= self.seaLevel )
+        self.temperature *= lapse
+        progress.finish()
+
+    def runLoop( self, progress = None ):
+        '''The original band by band painting, which the benchmark below times
+        run against'''
+        # setup or local variables
+        self.temperature = numpy.zeros( ( self.worldW, self.worldH ) )
+        if progress is None:
+            progress = Progress()
+        progressValue = 0
+        progress.start( self.worldH / self.resolution )
 
         for i in range( 0, self.worldH, self.resolution ):
-            if sb != None:
-                progress.setValue( progressValue )
-                progressValue += 1
+            progress.update( progressValue )
+            progressValue += 1
 
             # Generate band
             bandy = i
@@ -103,14 +167,19 @@ class Temperature():
                             self.temperature[x, y] = bandtemp * ( 1.0 - ( self.heightmap[x, y] - self.seaLevel ) )
 
             #break # for profiling 
-        if sb != None:
-            sb.removeWidget( progress )
-            del progress
+        progress.finish()
 
 if __name__ == '__main__':
-    heightmap = numpy.zeros( ( 256, 256 ) )
-    tempObject = Temperature( heightmap )
-    #tempObject.run()
-    import cProfile
-    cProfile.run( 'tempObject.run()' )
-    #print tempObject.temperature
+    import sys, time
+    sizes = [int( size ) for size in sys.argv[1:]] or [256, 1024, 4096]
+    for size in sizes:
+        heightmap = numpy.random.random( ( size, size ) )
+        tempObject = Temperature( heightmap, 25, seed = 1 )
+        start = time.time()
+        tempObject.run()
+        print( "run     %4d: %.3f seconds, mean %.4f" % ( size, time.time() - start, tempObject.temperature.mean() ) )
+        if size <= 256:
+            random.seed( 1 )
+            start = time.time()
+            tempObject.runLoop()
+            print( "runLoop %4d: %.3f seconds, mean %.4f" % ( size, time.time() - start, tempObject.temperature.mean() ) )
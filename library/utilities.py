@@ -19,7 +19,7 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 02110-1301 USA
 """
-import numpy, random
+import numpy, random, functools, itertools
 
 if __name__ == '__main__': # handle multiple entry points
     from constants import *
@@ -32,128 +32,158 @@ def inCircle(radius, center_x, center_y, x, y):
     squareDist = ( (center_x - x) ** 2 + (center_y - y) ** 2 )
     return squareDist <= radius ** 2
 
-def normalize(data, newMin=0.0, newMax=1.0):
-    # compress the range while maintaining ratio
+def normalize(data, newMin=0.0, newMax=1.0, inPlace=False, dtype=None):
+    '''Compress the range while maintaining ratio. Rescales data itself with
+    inPlace, otherwise into a new array of dtype (by default data's dtype, or
+    float64 for integer data). Constant data has no range, it becomes newMin.'''
     oldMin = numpy.amin(data)
     oldMax = numpy.amax(data)
-    orgShape = data.shape
-    data = numpy.reshape(data, data.size)
-    for x in range(data.size):
-            data[x] = (((data[x] - oldMin) * (newMax-newMin)) / (oldMax-oldMin)) + newMin
-    return numpy.reshape(data, orgShape)
+    if inPlace:
+        result = data
+    else:
+        if dtype is None:
+            dtype = data.dtype if data.dtype.kind == 'f' else numpy.float64
+        result = numpy.empty(data.shape, dtype=dtype)
+
+    if oldMax == oldMin:
+        result.fill(newMin)
+        return result
+
+    numpy.subtract(data, oldMin, out=result, casting='unsafe')
+    numpy.multiply(result, (newMax - newMin) / (oldMax - oldMin), out=result, casting='unsafe')
+    numpy.add(result, newMin, out=result, casting='unsafe')
+    return result
 
 def roof( data, limit ):
-    xArray,yArray = numpy.where(data > limit)
-    spikes = list(zip(xArray,yArray))
-    for x,y in spikes:
-        data[x,y] = limit
-    return data
+    '''Clip data to at most limit, in place'''
+    return numpy.minimum(data, limit, out=data)
 
 def floor( data, limit ):
-    xArray,yArray = numpy.where(data < limit)
-    spikes = list(zip(xArray,yArray))
-    for x,y in spikes:
-        data[x,y] = limit
-    return data
+    '''Clip data to at least limit, in place'''
+    return numpy.maximum(data, limit, out=data)
 
 
 def radialGradient( size, fitEdges=True, invert=True ):
     ''' Creates a radial gradient (half-sphere) to be used for masking images so
     that the edges have a curving sloop. You can specify the inverse as well as
-    fitting to the edges or corners of a 2D array. '''
-     
+    fitting to the edges or corners of a 2D array. The gradient is cached and
+    shared between callers, so it is read-only. '''
+    return cachedRadialGradient( tuple(size), fitEdges, invert )
+
+@functools.lru_cache(maxsize=4)
+def cachedRadialGradient( size, fitEdges, invert ):
     width, height = size
-    gradient = numpy.zeros(( size ))
     center_x, center_y = [width/2, height/2]
     midEdge = int((center_x - center_x) ** 2 + (center_y - 0) ** 2)
-    for x in range( width ):
-        for y in range( height ):
-            squareDist = int((center_x - x) ** 2 + (center_y - y) ** 2)
-            if invert:
-                gradient[x,y] = ~squareDist
-            else:
-                gradient[x,y] = squareDist
-    
+
+    # whole squared distance to the center, ~ of it when inverted
+    squareX = (center_x - numpy.arange(width)) ** 2
+    squareY = (center_y - numpy.arange(height)) ** 2
+    gradient = numpy.floor(squareX[:, numpy.newaxis] + squareY)
+    if invert:
+        gradient = numpy.negative(gradient, out=gradient) - 1
+
     if fitEdges and invert: 
         gradient = floor(gradient, ~midEdge)
     elif fitEdges:
         gradient = roof(gradient, midEdge)
-      
-    return normalize(gradient)
-  
+
+    gradient = normalize(gradient, dtype=numpy.float32)
+    gradient.flags.writeable = False
+    return gradient
+
 def frameGradient ( size, border=.1 ):
+    ''' Creates a frame that fades in from the edges over the border, a share of
+    the width, and is 1.0 inside of it. Cached and read-only like radialGradient. '''
+    return cachedFrameGradient( tuple(size), border )
+
+@functools.lru_cache(maxsize=4)
+def cachedFrameGradient( size, border ):
     width, height = size
-    gradient = numpy.ones(( size ))
     borderSize = int(width*border)
-    gBorder = numpy.linspace(0.0,1.0,borderSize)
-    
-    for x in range(width):
-        for y in range(borderSize):
-            value = gBorder[y]
-            
-            # top and bottom
-            gradient[x,y] = value
-            gradient[x,abs(y-height)-1] = value
-            
-            # left
-            if (gradient[y,x] > value):
-                gradient[y,x] = value
-            
-    for x in range(width):
-        for y in range(borderSize):
-            value = gBorder[y]
-            # right   
-            if (gradient[abs(y-height)-1,x] > value):
-                gradient[abs(y-height)-1,x] = value
-                pass
-            
+    gBorder = numpy.append(numpy.linspace(0.0,1.0,borderSize), 1.0)
+
+    # distance to the nearest edge, in cells, picks from the border values
+    edgeX = numpy.arange(width)
+    edgeX = numpy.minimum(edgeX, edgeX[::-1])
+    edgeY = numpy.arange(height)
+    edgeY = numpy.minimum(edgeY, edgeY[::-1])
+    edge = numpy.minimum(edgeX[:, numpy.newaxis], edgeY, dtype=numpy.intp)
+    gradient = gBorder.astype(numpy.float32)[numpy.minimum(edge, borderSize)]
+
+    gradient.flags.writeable = False
     return gradient
 
-def rollingParticleGradient( size, centerBias=True ):
-    import random
+def rollingParticleGradient( size, centerBias=True, particles=None, seed=None, batchSize=4096 ):
+    ''' Creates a mask by rolling particles downhill over it, each leaving a
+    deposit wherever it rolls to. Particles are dropped nearer the center
+    with centerBias. The budget of particles (by default one per cell) trades
+    quality for time, batches of them roll in lock-step. '''
     width, height = size
     gradient = numpy.ones(( size ))
-    
-    PARTICLEITERATIONS = width ** 2 #3000*5
+    rng = numpy.random.default_rng(seed)
+
+    PARTICLEITERATIONS = width * height if particles is None else particles
     PARTICLELIFE = 50*1
     EDGE_BIAS = 12
-    OUTER_BLUR = 0.75
-    INNER_BLUR = 0.88
-    
-    for iterations in range(PARTICLEITERATIONS):
+
+    # flat index offsets of the neighbours, in every possible order
+    neighbors = [dx * height + dy for dx, dy in DIR_NEIGHBORS]
+    orders = numpy.array(list(itertools.permutations(neighbors)))
+    cells = gradient.reshape(-1)
+
+    for batch in range(0, PARTICLEITERATIONS, batchSize):
+        count = min(batchSize, PARTICLEITERATIONS - batch)
+
         # Start nearer the center
         if centerBias:
-            sourceX = int(random.random() * (width-(EDGE_BIAS*2)) + EDGE_BIAS)
-            sourceY = int(random.random() * (height-(EDGE_BIAS*2)) + EDGE_BIAS)
+            sourceX = (rng.random(count) * (width-(EDGE_BIAS*2)) + EDGE_BIAS).astype(int)
+            sourceY = (rng.random(count) * (height-(EDGE_BIAS*2)) + EDGE_BIAS).astype(int)
         # Random starting location
         else:
-            sourceX = int(random.random() * (width - 1))
-            sourceY = int(random.random() * (height - 1))
-                
+            sourceX = (rng.random(count) * (width - 1)).astype(int)
+            sourceY = (rng.random(count) * (height - 1)).astype(int)
+
         for p in range(PARTICLELIFE):
-            sourceX += round(random.random() * 2 - 1)
-            sourceY += round(random.random() * 2 - 1)
-                                                        
-            if sourceX < 1 or sourceX > width -2 or sourceY < 1 or sourceY > height - 2:
-                break
-                
-            hood = []
-            for dx, dy in constants.DIR_NEIGHBORS:
-                direction = [sourceX + dx, sourceY + dy]
-                if not outOfBounds(direction, size):
-                    hood.append(direction)
-
-            random.shuffle(hood)
-                
-            for i in range(len(hood)):
-                x,y = hood[i]
-                if gradient[x,y] < gradient[sourceX,sourceY]:
-                    sourceX,sourceY = hood[i]
+            # wander -1, 0 or 1 with the odds of round(random.random() * 2 - 1)
+            step = rng.random((2, count))
+            sourceX += (step[0] >= 0.25).astype(int) + (step[0] >= 0.75) - 1
+            sourceY += (step[1] >= 0.25).astype(int) + (step[1] >= 0.75) - 1
+
+            # particles rolling over the edge are gone
+            alive = (sourceX >= 1) & (sourceX <= width - 2) & (sourceY >= 1) & (sourceY <= height - 2)
+            if not alive.all():
+                sourceX, sourceY = sourceX[alive], sourceY[alive]
+                count = len(sourceX)
+                if count == 0:
                     break
-                            
-            gradient[sourceX,sourceY] += 1
 
-    return normalize(gradient)
+            # visit the neighbours in random order, roll to the first lower one
+            source = sourceX * height + sourceY
+            hood = source[:, numpy.newaxis] + orders[rng.integers(len(orders), size=count)]
+            lower = cells[hood] < cells[source][:, numpy.newaxis]
+            first = numpy.argmax(lower, axis=1)
+            rolls = lower[numpy.arange(count), first]
+            target = hood[numpy.arange(count), first]
+            source = numpy.where(rolls, target, source)
+            sourceX, sourceY = numpy.divmod(source, height)
+
+            numpy.add.at(cells, source, 1)
+
+    return normalize(gradient, inPlace=True).astype(numpy.float32)
+
+def newSeed():
+    '''A fresh world seed, drawn from the operating system's entropy; it fits
+    the UInt64Col of the saved settings'''
+    return int(numpy.random.SeedSequence().generate_state(1, numpy.uint64)[0])
+
+def stageSeed( seed, stage ):
+    '''Seed for the random stream of a generation stage (one of the STAGE_
+    constants), independent of the other stages' streams. Without a world
+    seed every stage is seeded afresh.'''
+    if seed is None:
+        return None
+    return [seed, stage]
 
 def outOfBounds(source, size):
     ''' verify that we do not go over the edge of map '''
@@ -161,4 +191,84 @@ def outOfBounds(source, size):
     w, h = size
     if x < 0 or y < 0 or x >= w or y >= h:
         return True
-    return False
\ No newline at end of file
+    return False
+
+@functools.lru_cache(maxsize=4)
+def discOffsets( radius ):
+    '''Offsets within radius of a cell, nearest first, with the radius of the
+    smallest circle (as in inCircle) each one is in'''
+    dx, dy = numpy.mgrid[-radius:radius + 1, -radius:radius + 1]
+    dx, dy = dx.reshape(-1), dy.reshape(-1)
+    ring = numpy.ceil(numpy.sqrt(dx * dx + dy * dy)).astype(numpy.intp)
+    inside = (ring <= radius) & (ring > 0)
+    order = numpy.argsort(ring[inside], kind='stable')
+    offsets = dx[inside][order], dy[inside][order], ring[inside][order]
+    for offset in offsets:
+        offset.flags.writeable = False
+    return offsets
+
+def floodFill( data, x, y, level, wrap=True, visited=None ):
+    '''Flat indices of the cells connected to x, y whose data is at most
+    level. Scanline fill: a run of cells along a column is filled at once,
+    then the columns either side of it are searched for runs to fill next.
+    Cells set in visited, which is updated, are never looked at again, so a
+    fill costs in proportion to its area.'''
+    width, height = data.shape
+    if visited is None:
+        visited = numpy.zeros(data.shape, dtype=bool)
+    runs = []
+    stack = [(x, y)]
+    while stack:
+        x, y = stack.pop()
+        column, seen = data[x], visited[x]
+        if seen[y] or column[y] > level:
+            continue
+
+        # extend the run both ways along the column
+        top = y
+        while top > 0 and not seen[top - 1] and column[top - 1] <= level:
+            top -= 1
+        bottom = y
+        while bottom < height - 1 and not seen[bottom + 1] and column[bottom + 1] <= level:
+            bottom += 1
+        seen[top:bottom + 1] = True
+        runs.append(numpy.arange(x * height + top, x * height + bottom + 1))
+        if wrap:
+            if top == 0:
+                stack.append((x, height - 1))
+            if bottom == height - 1:
+                stack.append((x, 0))
+
+        # the start of every run of fillable cells next to this one
+        for nx in (x - 1, x + 1):
+            if wrap:
+                nx %= width
+            elif nx < 0 or nx >= width:
+                continue
+            fresh = (data[nx, top:bottom + 1] <= level) & ~visited[nx, top:bottom + 1]
+            starts = numpy.flatnonzero(fresh[1:] & ~fresh[:-1]) + 1
+            stack.extend((nx, top + start) for start in starts.tolist())
+            if fresh[0]:
+                stack.append((nx, top))
+
+    if not runs:
+        return numpy.zeros(0, dtype=numpy.intp)
+    return numpy.concatenate(runs)
+
+if __name__ == '__main__':
+    import time
+    for size in [1024, 4096]:
+        data = numpy.random.random((size, size)) * 100 - 50
+        for name, call in [('radialGradient', lambda: radialGradient((size, size))),
+                           ('radialGradient again', lambda: radialGradient((size, size))),
+                           ('frameGradient', lambda: frameGradient((size, size))),
+                           ('rollingParticle 1M', lambda: rollingParticleGradient((size, size), particles=2 ** 20, seed=1)),
+                           ('normalize', lambda: normalize(data)),
+                           ('normalize float32', lambda: normalize(data, dtype=numpy.float32)),
+                           ('normalize in place', lambda: normalize(data, inPlace=True)),
+                           ('roof', lambda: roof(data, 0.75)),
+                           ('floor', lambda: floor(data, 0.25)),
+                           ('floodFill disc', lambda: floodFill(radialGradient((size, size), invert=False), size // 2, size // 2, 0.5))]:
+            start = time.time()
+            call()
+            print("%-20s %4d: %.3f seconds" % (name, size, time.time() - start))
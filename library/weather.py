@@ -30,35 +30,111 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
 #        Sqrt(worldW^2+worldH^2) away
 #    The wind travels in direction of worldWinDir
 
-import math, random, numpy
-from PySide import QtGui
+import math, numpy
 
 if __name__ == '__main__': # handle multiple entry points
     from constants import *
+    from progress import Progress
 else:
     from .constants import *
+    from .progress import Progress
 
 class Weather():
-    def __init__( self, heightmap, temperature ):
+    def __init__( self, heightmap, temperature, seed = None ):
         self.heightmap = heightmap
         self.temperature = temperature
+        self.seed = seed
 
-    def run( self, sb = None ):
+    def windDirection( self ):
+        '''Direction the wind blows in, 0 to 360 degrees; the same for every
+        run with the same seed'''
+        return int( numpy.random.default_rng( self.seed ).integers( 0, 361 ) )
+
+    def run( self, progress = None ):
+        # setup or local variables
+        rainFall = 1.0
+        worldW = len( self.heightmap )
+        worldH = len( self.heightmap[0] )
+        r = int( math.sqrt( worldW * worldW + worldH * worldH ) )
+        if progress is None:
+            progress = Progress()
+        progressValue = 0
+        progress.start( r )
+        self.windMap = numpy.zeros( ( worldW, worldH ) )
+        self.rainMap = numpy.zeros( ( worldW, worldH ) )
+        self.erosionMap = numpy.zeros( ( worldW, worldH ) )
+        worldWindDir = self.windDirection()
+        theta1 = worldWindDir * WIND_PARITY + WIND_OFFSET
+        theta2 = 180 - 90 - ( worldWindDir * WIND_PARITY + WIND_OFFSET )
+        sinT1 = math.sin( theta1 )
+        sinT2 = math.sin( theta2 )
+        mapsqrt = math.sqrt( worldW * worldW + worldH * worldH )
+        rainAmount = ( ( rainFall * mapsqrt ) / WGEN_WIND_RESOLUTION ) * WGEN_RAIN_FALLOFF
+        rainMap = numpy.zeros( ( worldW, worldH ) )
+        rainMap.fill( rainAmount )
+
+        # cast wind and rain, each offset at once over the window it overlaps
+        rainKept = 1.0 - ( self.temperature / 2.0 ) # share of remaining rain held on to
+        scratch = numpy.empty( ( worldW, worldH ) )
+        for d in range( r , -1, -WGEN_WIND_RESOLUTION ):
+            windx = int( d * sinT1 )
+            windy = int( d * sinT2 )
+
+            # continue (next d) if above are bigger than our map size
+            if math.fabs( windx ) > worldW or math.fabs( windy ) > worldH:
+                continue # do no more processing, go to next value
+
+            # calculate our range to save cpu cycles
+            xBegin = max( -windx, 0 )
+            yBegin = max( -windy, 0 )
+            xEnd = min( worldW - windx, worldW )
+            yEnd = min( worldH - windy, worldH )
+
+            # the window and where the wind comes from, every cell in it only
+            # depends on itself so the whole window is done in one go
+            here = ( slice( xBegin, xEnd ), slice( yBegin, yEnd ) )
+            there = ( slice( xBegin + windx, xEnd + windx ), slice( yBegin + windy, yEnd + windy ) )
+            windMap = self.windMap[here]
+            remaining = rainMap[here]
+            rlost = scratch[:max( xEnd - xBegin, 0 ), :max( yEnd - yBegin, 0 )]
+
+            # set our wind
+            numpy.multiply( windMap, WGEN_WIND_GRAVITY, out = windMap )
+            numpy.maximum( windMap, self.heightmap[there], out = windMap )
+
+            # calculate how much rain is remaining
+            numpy.divide( remaining, rainAmount, out = rlost )
+            rlost *= rainKept[here]
+
+            # calculate our rainfall
+            rlost *= windMap
+            numpy.maximum( rlost, 0, out = rlost )
+            self.rainMap[there] = rlost
+
+            # calculate rain loss due raining
+            remaining -= rlost
+            numpy.maximum( remaining, 0, out = remaining )
+
+            progress.update( progressValue )
+            progressValue += WGEN_WIND_RESOLUTION
+        progress.finish()
+
+    def runLoop( self, progress = None ):
+        '''The original cell by cell cast, the benchmark below checks that run
+        gives the same wind and rain'''
         # setup or local variables
         rainFall = 1.0
         worldW = len( self.heightmap )
         worldH = len( self.heightmap[0] )
         r = int( math.sqrt( worldW * worldW + worldH * worldH ) )
-        if sb != None:
-            progressValue = 0
-            progress = QtGui.QProgressBar()
-            progress.setRange( 0, r )
-            sb.addPermanentWidget( progress )
-            progress.setValue( 0 )
+        if progress is None:
+            progress = Progress()
+        progressValue = 0
+        progress.start( r )
         self.windMap = numpy.zeros( ( worldW, worldH ) )
         self.rainMap = numpy.zeros( ( worldW, worldH ) )
         self.erosionMap = numpy.zeros( ( worldW, worldH ) )
-        worldWindDir = random.randint( 0, 360 )
+        worldWindDir = self.windDirection()
         theta1 = worldWindDir * WIND_PARITY + WIND_OFFSET
         theta2 = 180 - 90 - ( worldWindDir * WIND_PARITY + WIND_OFFSET )
         sinT1 = math.sin( theta1 )
@@ -124,17 +200,23 @@ class Weather():
                         rainMap[x, y] = 0
             #break
 
-            if sb != None:
-                progress.setValue( progressValue )
-                progressValue += WGEN_WIND_RESOLUTION
-        if sb != None:
-            sb.removeWidget( progress )
-            del progress
+            progress.update( progressValue )
+            progressValue += WGEN_WIND_RESOLUTION
+        progress.finish()
 
 if __name__ == '__main__':
-    heightMap = numpy.zeros( ( 128, 128 ) )
-    tempMap = numpy.zeros( ( 128, 128 ) )
-    warObject = Weather( heightMap, tempMap )
-    import cProfile
-    cProfile.run( 'warObject.run()' )
-    #warObject.run()
+    import sys, time
+    sizes = [int( size ) for size in sys.argv[1:]] or [256, 1024, 2048]
+    for size in sizes:
+        heightMap = numpy.random.random( ( size, size ) )
+        tempMap = numpy.random.random( ( size, size ) )
+        warObject = Weather( heightMap, tempMap, seed = 1 )
+        start = time.time()
+        warObject.run()
+        print( "run     %4d: %.3f seconds" % ( size, time.time() - start ) )
+        if size <= 256:
+            windMap, rainMap = warObject.windMap, warObject.rainMap
+            start = time.time()
+            warObject.runLoop()
+            print( "runLoop %4d: %.3f seconds, same wind and rain: %s" % ( size, time.time() - start,
+                   ( windMap == warObject.windMap ).all() and ( rainMap == warObject.rainMap ).all() ) )
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Part of the World Generator project.
+
+author:  Bret Curtis
+license: LGPL v2
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+version 2 as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+02110-1301 USA
+"""
+#
+# Headless world generation, chains the same stages as MapGen.genWorld
+# without needing a GUI.
+#
+import numpy
+
+if __name__ == '__main__': # handle multiple entry points
+    import utilities
+    from constants import *
+    from heightmap import HeightMap
+    from temperature import Temperature
+    from weather import Weather
+    from rivers import Rivers
+    from biomes import Biomes
+else:
+    from . import utilities
+    from .constants import *
+    from .heightmap import HeightMap
+    from .temperature import Temperature
+    from .weather import Weather
+    from .rivers import Rivers
+    from .biomes import Biomes
+
+# same defaults as the New World dialog
+WORLD_DEFAULTS = dict(
+                      width=256,
+                      height=256,
+                      algorithm=HM_DSA,
+                      roughness=5,
+                      avgLandmass=True,
+                      avgElevation=True,
+                      hasMountains=True,
+                      hemisphere=None, # random
+                      isIsland=True,
+                      seaLevel=25,
+                      seed=None # random, every stage draws from a stream derived from it
+                      )
+
+class World():
+    '''A world and its datasets, generated without a GUI. Stages reuse the
+    layers in cache, a LayerCache, when given one.'''
+
+    def __init__(self, settings=None, cache=None):
+        self.settings = dict(WORLD_DEFAULTS)
+        if settings:
+            self.settings.update(settings)
+        self.mapSize = (int(self.settings['width']), int(self.settings['height']))
+        self.seaLevel = self.settings['seaLevel']
+        self.cache = cache
+
+        self.elevation      = None
+        self.wind           = None
+        self.rainfall       = None
+        self.temperature    = None
+        self.drainage       = None
+        self.rivers         = None
+        self.lakes          = None
+        self.erosion        = None
+        self.biome          = None
+        self.biomeColour    = None
+
+    def genWorld(self):
+        if self.settings['seed'] is None:
+            self.settings['seed'] = utilities.newSeed()
+        if self.settings['hemisphere'] is None:
+            rng = numpy.random.default_rng(self.stageSeed(STAGE_HEMISPHERE))
+            self.settings['hemisphere'] = int(rng.integers(1, 4))
+        self.genHeightMap()
+        self.genHeatMap()
+        self.genWeatherMap()
+        self.genDrainageMap()
+        self.genRiverMap()
+        self.genBiomeMap()
+
+    def stageSeed(self, stage):
+        return utilities.stageSeed(self.settings['seed'], stage)
+
+    def fetchLayers(self, stage, inputs, parameters, generate):
+        '''Layers of a stage from the cache, generated when not in it; only
+        a seeded world generates the same layers again'''
+        if self.cache is None or self.settings['seed'] is None:
+            return generate()
+        parameters['seed'] = self.settings['seed']
+        return self.cache.fetch(stage, inputs, parameters, generate)
+
+    def genHeightMap(self):
+        '''Generate our heightmap, retrying until it is workable'''
+        settings = self.settings
+        def generate():
+            heightObject = HeightMap(self.mapSize, settings['roughness'], settings['isIsland'],
+                                     self.stageSeed(STAGE_HEIGHTMAP))
+            while True:
+                heightObject.run(settings['algorithm'])
+                if settings['avgLandmass'] and not 0.15 <= heightObject.landMassPercent() <= 0.85:
+                    continue
+                if settings['avgElevation'] and not 0.2 <= heightObject.averageElevation() <= 0.8:
+                    continue
+                if settings['hasMountains'] and not heightObject.hasMountains():
+                    continue
+                break
+            return {'elevation': heightObject.heightmap}
+        parameters = {k: settings[k] for k in ['algorithm', 'roughness', 'isIsland', 'avgLandmass',
+                                               'avgElevation', 'hasMountains']}
+        parameters['size'] = self.mapSize
+        self.elevation = self.fetchLayers('heightmap', [], parameters, generate)['elevation']
+
+    def genHeatMap(self):
+        def generate():
+            tempObject = Temperature(self.elevation, self.seaLevel, self.settings['hemisphere'],
+                                     seed=self.stageSeed(STAGE_TEMPERATURE))
+            tempObject.run()
+            return {'temperature': tempObject.temperature}
+        parameters = {'seaLevel': self.seaLevel, 'hemisphere': self.settings['hemisphere']}
+        self.temperature = self.fetchLayers('heatmap', [self.elevation], parameters, generate)['temperature']
+
+    def genWeatherMap(self):
+        def generate():
+            weatherObject = Weather(self.elevation, self.temperature, self.stageSeed(STAGE_WEATHER))
+            weatherObject.run()
+            return {'wind': weatherObject.windMap, 'rainfall': weatherObject.rainMap,
+                    'erosion': weatherObject.erosionMap}
+        layers = self.fetchLayers('weather', [self.elevation, self.temperature], {}, generate)
+        self.wind = layers['wind']
+        self.rainfall = layers['rainfall']
+        self.erosion = layers['erosion']
+
+    def genDrainageMap(self):
+        def generate():
+            drainObject = HeightMap(self.mapSize, seed=self.stageSeed(STAGE_DRAINAGE))
+            drainObject.run(HM_DSA)
+            return {'drainage': drainObject.heightmap}
+        self.drainage = self.fetchLayers('drainage', [], {'size': self.mapSize}, generate)['drainage']
+
+    def genRiverMap(self):
+        def generate():
+            riversObject = Rivers()
+            riversObject.generate(self.elevation, self.seaLevel, self.rainfall, seed=self.stageSeed(STAGE_RIVERS))
+            return {'rivers': riversObject.riverMap, 'lakes': riversObject.lakeMap,
+                    'erosion': riversObject.erosionMap}
+        layers = self.fetchLayers('rivers', [self.elevation, self.rainfall], {'seaLevel': self.seaLevel}, generate)
+        self.rivers = layers['rivers']
+        self.lakes = layers['lakes']
+        self.erosion = self.erosion + layers['erosion']
+
+    def genBiomeMap(self):
+        def generate():
+            biomeObject = Biomes(self.elevation, self.rainfall, self.drainage, self.temperature, self.seaLevel)
+            biomeObject.run()
+            return {'biome': biomeObject.biome, 'biomeColour': biomeObject.biomeColourCode}
+        inputs = [self.elevation, self.rainfall, self.drainage, self.temperature]
+        layers = self.fetchLayers('biomes', inputs, {'seaLevel': self.seaLevel}, generate)
+        self.biome = layers['biome']
+        self.biomeColour = layers['biomeColour']
+
+    def datasets(self):
+        '''Package up our world data, same layout as MapGen.world'''
+        return {
+          'elevation': self.elevation,
+          'wind': self.wind,
+          'rainfall': self.rainfall,
+          'temperature': self.temperature,
+          'drainage': self.drainage,
+          'rivers': self.rivers,
+          'lakes': self.lakes,
+          'erosion': self.erosion,
+          'biome': self.biome,
+          'biomeColour': self.biomeColour,
+          }
+
+    def save(self, fileLocation):
+        settings = dict(self.settings)
+        if settings['seed'] is None: # never generated
+            del settings['seed']
+        saveWorld(fileLocation, self.datasets(), settings)
+
+def saveWorld(fileLocation, world, settings):
+    '''Write the datasets and settings of a world to a HDF5 file that
+    MapGen.openWorld can read back'''
+    import tables
+    h5Filter = tables.Filters(complevel=9, complib='zlib', shuffle=True, fletcher32=True)
+    h5file = tables.openFile(fileLocation, mode='w', title="worldData", filters=h5Filter)
+
+    # store our numpy datasets
+    for k in world:
+        if world[k] is not None:
+            atom = tables.Atom.from_dtype(world[k].dtype)
+            shape = world[k].shape
+            cArray = h5file.createCArray(h5file.root, k, atom, shape)
+            cArray[:] = world[k]
+
+    # store our world settings
+    pyDict = {
+        'key'         : tables.StringCol(itemsize=40),
+        'value'       : tables.UInt64Col(), # wide enough for the seed
+    }
+    settingsTable = h5file.createTable('/', 'settings', pyDict)
+    settingsTable.append(list(settings.items()))
+    settingsTable.cols.key.createIndex()  # create an index
+
+    h5file.close()
+    del h5file, h5Filter
+
+if __name__ == '__main__':
+    world = World({'width': 128, 'height': 128, 'seed': 1})
+    import cProfile
+    cProfile.run('world.genWorld()')
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+World Generator: Generating worlds in batches
+
+Headless generation of many worlds at once, no GUI is needed. Every
+world is generated in its own worker process and written to its own
+file which can be opened in worldsynth.py.
+
+author:  Bret Curtis
+license: LGPL v2
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+version 2 as published by the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA
+02110-1301 USA
+"""
+# system libraries
+import os, json, time, multiprocessing
+
+# mapGen libraries
+from library.constants import MASK_PARTICLE
+from library.world import World
+from library.layerCache import LayerCache
+
+def generateWorld(job):
+    '''Worker: generate and save a single world'''
+    settings, fileLocation, useCache = job
+    start = time.time()
+    world = World(settings, LayerCache() if useCache else None)
+    world.genWorld()
+    world.save(fileLocation)
+    return fileLocation, time.time() - start
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="generate worlds without a GUI")
+    parser.add_argument("-c", "--config", help="JSON file with a list of world settings")
+    parser.add_argument("-n", "--count", help="number of worlds to generate", type=int, default=1)
+    parser.add_argument("-s", "--seed", help="seed of the first world, next worlds count up", type=int, default=0)
+    parser.add_argument("--size", help="width and height of the worlds", type=int, nargs=2)
+    parser.add_argument("--particle-mask", help="shape islands by rolling particles instead of a radial gradient",
+                        action="store_true")
+    parser.add_argument("--cache", help="reuse the layers kept in ~/.mapGen/cache", action="store_true")
+    parser.add_argument("-o", "--output", help="directory to write worlds to", default=".")
+    parser.add_argument("-j", "--processes", help="number of worker processes", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("-v", "--verbosity", help="increase output verbosity",
+                        action="store_true")
+    args = parser.parse_args()
+
+    if args.config:
+        with open(args.config) as configFile:
+            configs = json.load(configFile)
+    else:
+        configs = [{'seed': args.seed + i} for i in range(args.count)]
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    jobs = []
+    for i, settings in enumerate(configs):
+        if args.size and 'width' not in settings:
+            settings['width'], settings['height'] = args.size
+        if args.particle_mask and 'isIsland' not in settings:
+            settings['isIsland'] = MASK_PARTICLE
+        if settings.get('seed') is None:
+            settings['seed'] = args.seed + i
+        if args.config: # entries may share a seed, their index tells them apart
+            fileName = 'world-' + str(i) + '-' + str(settings['seed']) + '.h5'
+        else:
+            fileName = 'world-' + str(settings['seed']) + '.h5'
+        jobs.append((settings, os.path.join(args.output, fileName), args.cache))
+
+    start = time.time()
+    pool = multiprocessing.Pool(args.processes)
+    for fileLocation, seconds in pool.imap_unordered(generateWorld, jobs):
+        if args.verbosity:
+            print("Generated %s in %.1f seconds" % (fileLocation, seconds))
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+
+    print("Generated %d worlds in %.1f seconds with %d processes, %.2f worlds per minute" %
+          (len(jobs), elapsed, args.processes, len(jobs) / elapsed * 60))
+
+if __name__ == '__main__':
+    main()
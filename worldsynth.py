@@ -29,12 +29,16 @@ from PySide import QtGui, QtCore, QtUiTools, QtXml
 # mapGen libraries
 from library.constants import *
 from library.menu import Menu
-from library.render import Render
+from library.render import Render, RenderCache, RENDER_LAYERS
 from library.heightmap import HeightMap
 from library.temperature import Temperature
 from library.weather import Weather
 from library.rivers import Rivers
 from library.biomes import Biomes
+from library.world import saveWorld
+from library.layerCache import LayerCache
+from library.utilities import newSeed, stageSeed
+from library.progress import StatusBarProgress
 
 class MapGen(QtGui.QMainWindow):
 
@@ -50,15 +54,18 @@ class MapGen(QtGui.QMainWindow):
         self.homeDir = os.path.expanduser('~') + os.sep + '.mapGen'
         if not os.path.exists(self.homeDir):
             os.makedirs(self.homeDir)
+        self.layerCache = LayerCache(self.homeDir + os.sep + 'cache')
 
         # set our state
         # self.settings = QSettings("Mindwerks", "mapGen")
         self.viewState = VIEWER_HEIGHTMAP
 
         # set initial world data
+        self.renderCache = RenderCache()
         self.resetDatasets()
         self.elevation = numpy.zeros(self.mapSize)
         self.world = {'elevation': self.elevation}
+        self.versions = {}
         
         # display the GUI!
         self.initUI()
@@ -114,7 +121,8 @@ class MapGen(QtGui.QMainWindow):
         self.avgLandmass    = self.dNewWorld.cbAvgLandmass.isChecked()
         self.avgElevation   = self.dNewWorld.cbAvgElevation.isChecked()
         self.hasMountains   = self.dNewWorld.cbMountains.isChecked()
-        self.isIsland       = self.dNewWorld.cbIslands.isChecked()
+        self.isIsland       = self.getIslands()
+        self.seed           = newSeed() # every stage draws from a stream derived from it
         self.hemisphere     = self.getHemisphere()   
         self.seaLevel       = self.dNewWorld.sbSeaLevel.value()
 
@@ -174,6 +182,11 @@ class MapGen(QtGui.QMainWindow):
 
         self.statusBar().showMessage(' At position: ' + sX + ',' + sY + ' - ' + message)
 
+    def fetchLayers(self, stage, inputs, parameters, generate):
+        '''Layers of a stage from the layer cache, generated when not in it'''
+        parameters['seed'] = self.seed
+        return self.layerCache.fetch(stage, inputs, parameters, generate)
+
     def genWorld(self):
         self.genHeightMap()
         self.genHeatMap()
@@ -197,6 +210,14 @@ class MapGen(QtGui.QMainWindow):
         
         return method
 
+    def getIslands(self):
+        '''Island mask of the heightmap, False for none'''
+        if not self.dNewWorld.cbIslands.isChecked():
+            return False
+        if self.dNewWorld.cbParticleMask.isChecked():
+            return MASK_PARTICLE
+        return MASK_RADIAL
+
     def setAlgorithm(self, method): 
         if method == HM_MDA:
             self.dNewWorld.rMDA.click()
@@ -216,52 +237,57 @@ class MapGen(QtGui.QMainWindow):
         self.sb.showMessage('Generating heightmap...')
 
         # create our heightmap
-        heightObject = HeightMap(self.mapSize, self.roughness, self.isIsland)
-        found = False
-        # method = 3 #testing
-        while not found:  # loop until we have something workable
-            heightObject.run( self.getAlgorithm() )
-            #break #testing
-            if self.avgLandmass and heightObject.landMassPercent() < 0.15:
-                self.statusBar().showMessage('Too little land mass')
-            elif self.avgLandmass and  heightObject.landMassPercent() > 0.85:
-                self.statusBar().showMessage('Too much land mass')
-            elif self.avgElevation and heightObject.averageElevation() < 0.2:
-                self.statusBar().showMessage('Average elevation is too low')
-            elif self.avgElevation and heightObject.averageElevation() > 0.8:
-                self.statusBar().showMessage('Average elevation is too high')
-            elif self.hasMountains and not heightObject.hasMountains():
-                self.statusBar().showMessage('Not enough mountains')
-            else:
-                found = True
-
-        self.elevation = heightObject.heightmap
-        del heightObject
+        algorithm = self.getAlgorithm()
+        def generate():
+            heightObject = HeightMap(self.mapSize, self.roughness, self.isIsland, stageSeed(self.seed, STAGE_HEIGHTMAP))
+            found = False
+            # method = 3 #testing
+            while not found:  # loop until we have something workable
+                heightObject.run( algorithm )
+                #break #testing
+                if self.avgLandmass and heightObject.landMassPercent() < 0.15:
+                    self.statusBar().showMessage('Too little land mass')
+                elif self.avgLandmass and  heightObject.landMassPercent() > 0.85:
+                    self.statusBar().showMessage('Too much land mass')
+                elif self.avgElevation and heightObject.averageElevation() < 0.2:
+                    self.statusBar().showMessage('Average elevation is too low')
+                elif self.avgElevation and heightObject.averageElevation() > 0.8:
+                    self.statusBar().showMessage('Average elevation is too high')
+                elif self.hasMountains and not heightObject.hasMountains():
+                    self.statusBar().showMessage('Not enough mountains')
+                else:
+                    found = True
+            return {'elevation': heightObject.heightmap}
+
+        parameters = dict(size=self.mapSize, algorithm=algorithm, roughness=self.roughness,
+                          isIsland=self.isIsland, avgLandmass=self.avgLandmass,
+                          avgElevation=self.avgElevation, hasMountains=self.hasMountains)
+        self.elevation = self.fetchLayers('heightmap', [], parameters, generate)['elevation']
         self.viewHeightMap()
         self.statusBar().showMessage('Successfully generated a heightmap!')
 
     def viewHeightMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('heightmap')))
+        self.mainImage.setPixmap(self.renderMap('heightmap'))
         self.viewState = VIEWER_HEIGHTMAP
         self.statusBar().showMessage('Viewing heightmap.')
 
     def viewElevation(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('elevation', self.seaLevel)))
+        self.mainImage.setPixmap(self.renderMap('elevation', self.seaLevel))
         self.viewState = VIEWER_HEIGHTMAP
         self.statusBar().showMessage('Viewing elevation.')
 
     def viewSeaLevel(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('sealevel', self.seaLevel)))
+        self.mainImage.setPixmap(self.renderMap('sealevel', self.seaLevel))
         self.viewState = VIEWER_HEIGHTMAP
         self.statusBar().showMessage('Viewing sealevel.')
 
     def getHemisphere(self):
-        from random import randint
         if self.dNewWorld.rbHemisphereRandom.isChecked():
-            hemisphere = randint(1, 3)
+            rng = numpy.random.default_rng(stageSeed(self.seed, STAGE_HEMISPHERE))
+            hemisphere = int(rng.integers(1, 4))
         elif self.dNewWorld.rbHemisphereBoth.isChecked():
             hemisphere = WGEN_HEMISPHERE_EQUATOR
         elif self.dNewWorld.rbHemisphereNorth.isChecked():
@@ -292,22 +318,26 @@ class MapGen(QtGui.QMainWindow):
             return
         
         self.statusBar().showMessage('Generating heatmap...')
-        tempObject = Temperature(self.elevation, self.seaLevel, self.getHemisphere())
-        tempObject.run(sb=self.sb)
-        self.temperature = tempObject.temperature
-        del tempObject
+        hemisphere = self.getHemisphere()
+        def generate():
+            tempObject = Temperature(self.elevation, self.seaLevel, hemisphere,
+                                     seed=stageSeed(self.seed, STAGE_TEMPERATURE))
+            tempObject.run(StatusBarProgress(self.sb))
+            return {'temperature': tempObject.temperature}
+        parameters = dict(seaLevel=self.seaLevel, hemisphere=hemisphere)
+        self.temperature = self.fetchLayers('heatmap', [self.elevation], parameters, generate)['temperature']
         self.viewHeatMap()
         self.statusBar().showMessage('Successfully generated a heatmap!')
 
     def viewHeatMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('heatmap')))
+        self.mainImage.setPixmap(self.renderMap('heatmap'))
         self.viewState = VIEWER_HEATMAP
         self.statusBar().showMessage('Viewing heatmap.')
 
     def viewRawHeatMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('rawheatmap')))
+        self.mainImage.setPixmap(self.renderMap('rawheatmap'))
         self.viewState = VIEWER_HEATMAP
         self.statusBar().showMessage('Viewing raw heatmap.')
 
@@ -320,46 +350,50 @@ class MapGen(QtGui.QMainWindow):
         if self.temperature is None:
             self.statusBar().showMessage('Error: No heatmap!')
             return
-        weatherObject = Weather(self.elevation, self.temperature)
-        weatherObject.run(self.sb)
-        self.wind = weatherObject.windMap
-        self.rainfall = weatherObject.rainMap
-        self.erosion = weatherObject.erosionMap
-        del weatherObject
+        def generate():
+            weatherObject = Weather(self.elevation, self.temperature, stageSeed(self.seed, STAGE_WEATHER))
+            weatherObject.run(StatusBarProgress(self.sb))
+            return {'wind': weatherObject.windMap, 'rainfall': weatherObject.rainMap,
+                    'erosion': weatherObject.erosionMap}
+        layers = self.fetchLayers('weather', [self.elevation, self.temperature], {}, generate)
+        self.wind = layers['wind']
+        self.rainfall = layers['rainfall']
+        self.erosion = layers['erosion']
         self.viewWeatherMap()
         self.statusBar().showMessage('Successfully generated weather!')
 
     def viewWeatherMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('windandrainmap')))
+        self.mainImage.setPixmap(self.renderMap('windandrainmap'))
         self.viewState = VIEWER_RAINFALL
         self.statusBar().showMessage('Viewing weathermap.')
 
     def viewWindMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('windmap')))
+        self.mainImage.setPixmap(self.renderMap('windmap'))
         self.viewState = VIEWER_WIND
         self.statusBar().showMessage('Viewing windmap.')
 
     def viewPrecipitation(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('rainmap')))
+        self.mainImage.setPixmap(self.renderMap('rainmap'))
         self.viewState = VIEWER_RAINFALL
         self.statusBar().showMessage('Viewing rainmap.')
 
     def genDrainageMap(self):
         '''Generate a fractal drainage map'''
         self.sb.showMessage('Generating drainage...')
-        drainObject = HeightMap(self.mapSize)
-        drainObject.run(HM_DSA)
-        self.drainage = drainObject.heightmap
-        del drainObject
+        def generate():
+            drainObject = HeightMap(self.mapSize, seed=stageSeed(self.seed, STAGE_DRAINAGE))
+            drainObject.run(HM_DSA)
+            return {'drainage': drainObject.heightmap}
+        self.drainage = self.fetchLayers('drainage', [], dict(size=self.mapSize), generate)['drainage']
         self.viewDrainageMap()
         self.statusBar().showMessage('Successfully generated drainage!')
 
     def viewDrainageMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('drainagemap')))
+        self.mainImage.setPixmap(self.renderMap('drainagemap'))
         self.viewState = VIEWER_DRAINAGE
         self.statusBar().showMessage('Viewing drainmap.')
 
@@ -378,17 +412,20 @@ class MapGen(QtGui.QMainWindow):
         if self.wind.sum is None or self.rainfall is None:
             self.statusBar().showMessage('Error: No weather!')
             return
-        biomeObject = Biomes(self.elevation, self.rainfall, self.drainage, self.temperature, self.seaLevel)
-        biomeObject.run()
-        self.biome = biomeObject.biome
-        self.biomeColour = biomeObject.biomeColourCode
-        del biomeObject
+        def generate():
+            biomeObject = Biomes(self.elevation, self.rainfall, self.drainage, self.temperature, self.seaLevel)
+            biomeObject.run()
+            return {'biome': biomeObject.biome, 'biomeColour': biomeObject.biomeColourCode}
+        inputs = [self.elevation, self.rainfall, self.drainage, self.temperature]
+        layers = self.fetchLayers('biomes', inputs, dict(seaLevel=self.seaLevel), generate)
+        self.biome = layers['biome']
+        self.biomeColour = layers['biomeColour']
         self.viewBiomeMap()
         self.statusBar().showMessage('Successfully generated biomes!')
 
     def viewBiomeMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('biomemap')))
+        self.mainImage.setPixmap(self.renderMap('biomemap'))
         self.viewState = VIEWER_BIOMES
         self.statusBar().showMessage('Viewing biomes.')
 
@@ -404,36 +441,51 @@ class MapGen(QtGui.QMainWindow):
         if self.drainage is None:
             self.statusBar().showMessage('Error: No drainage!')
             return
-        riversObject = Rivers()
-        riversObject.generate(self.elevation, self.seaLevel, self.rainfall, self.sb)
-        self.rivers = riversObject.riverMap
-        self.lakes = riversObject.lakeMap
-        self.erosion += riversObject.erosionMap
-        del riversObject
+        def generate():
+            riversObject = Rivers()
+            riversObject.generate(self.elevation, self.seaLevel, self.rainfall, StatusBarProgress(self.sb),
+                                  seed=stageSeed(self.seed, STAGE_RIVERS))
+            return {'rivers': riversObject.riverMap, 'lakes': riversObject.lakeMap,
+                    'erosion': riversObject.erosionMap}
+        inputs = [self.elevation, self.rainfall]
+        layers = self.fetchLayers('rivers', inputs, dict(seaLevel=self.seaLevel), generate)
+        self.rivers = layers['rivers']
+        self.lakes = layers['lakes']
+        self.erosion = self.erosion + layers['erosion']
         self.viewRiverMap()
         self.statusBar().showMessage('Successfully generated rivers and lakes!')
 
     def viewRiverMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('rivermap', self.seaLevel)))
+        self.mainImage.setPixmap(self.renderMap('rivermap', self.seaLevel))
         self.viewState = VIEWER_RIVERS
         self.statusBar().showMessage('Viewing rivers and lakes.')
 
     def viewErosionMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('erosionmap')))
+        self.mainImage.setPixmap(self.renderMap('erosionmap'))
         self.viewState = VIEWER_EROSION
         self.statusBar().showMessage('Viewing raw erosion.')
     
     def viewErosionAppliedMap(self):
         self.updateWorld()
-        self.mainImage.setPixmap(QtGui.QPixmap.fromImage(Render(self.world).convert('erosionappliedmap')))
+        self.mainImage.setPixmap(self.renderMap('erosionappliedmap'))
         self.viewState = VIEWER_EROSIONAPP
         self.statusBar().showMessage('Viewing applied erosion map.')
     
+    def renderMap(self, mapType, seaLevel=None):
+        '''Render a map type, or reuse the last rendering if none of the
+        datasets it is drawn from have changed since'''
+        key = (mapType, seaLevel) + tuple(self.versions.get(k, 0) for k in RENDER_LAYERS[mapType])
+        pixmap = self.renderCache.get(key)
+        if pixmap is None:
+            pixmap = QtGui.QPixmap.fromImage(Render(self.world).convert(mapType, seaLevel))
+            self.renderCache.put(key, pixmap, pixmap.width() * pixmap.height() * 4)
+        return pixmap
+
     def updateWorld(self):
         # update and package up our world data
-        self.world = {
+        world = {
           'elevation': self.elevation,
           'wind': self.wind,
           'rainfall': self.rainfall,
@@ -445,6 +497,13 @@ class MapGen(QtGui.QMainWindow):
           'biome': self.biome,
           'biomeColour': self.biomeColour,
           }
+
+        # generators replace datasets rather than modify them, a new one
+        # gets a new version so its old renderings are no longer used
+        for k in world:
+            if world[k] is not self.world.get(k):
+                self.versions[k] = self.versions.get(k, 0) + 1
+        self.world = world
         self.mapSize = self.elevation.shape
 
     def resetDatasets(self):
@@ -458,6 +517,7 @@ class MapGen(QtGui.QMainWindow):
         self.erosion        = None        
         self.biome          = None
         self.biomeColour    = None
+        self.renderCache.clear()
         
     def newWorld(self):
         self.dNewWorld.show()
@@ -476,7 +536,8 @@ class MapGen(QtGui.QMainWindow):
         self.avgLandmass    = self.dNewWorld.cbAvgLandmass.isChecked()
         self.avgElevation   = self.dNewWorld.cbAvgElevation.isChecked()
         self.hasMountains   = self.dNewWorld.cbMountains.isChecked()
-        self.isIsland       = self.dNewWorld.cbIslands.isChecked()
+        self.isIsland       = self.getIslands()
+        self.seed           = newSeed()
         self.hemisphere     = self.getHemisphere()
         self.seaLevel       = self.dNewWorld.sbSeaLevel.value()
         self.resetDatasets()
@@ -513,24 +574,6 @@ class MapGen(QtGui.QMainWindow):
             alreadyTried = True
             self.saveWorldAs()
         else:
-            h5Filter = tables.Filters(complevel=9, complib='zlib', shuffle=True, fletcher32=True)
-            h5file = tables.openFile(self.fileLocation, mode='w', title="worldData", filters=h5Filter)
-            
-            # store our numpy datasets
-            for k in self.world:
-                if self.world[k] is not None:
-                    atom = tables.Atom.from_dtype(self.world[k].dtype)
-                    shape = self.world[k].shape
-                    cArray = h5file.createCArray(h5file.root, k, atom, shape)
-                    cArray[:] = self.world[k]
-        
-            # store our world settings
-            pyDict = {
-                'key'         : tables.StringCol(itemsize=40),
-                'value'       : tables.UInt16Col(),
-            }
-            settingsTable = h5file.createTable('/', 'settings', pyDict)
-            
             settings = dict(
                             width=self.mapSize[0],                            
                             height=self.mapSize[1],
@@ -541,14 +584,10 @@ class MapGen(QtGui.QMainWindow):
                             hasMountains=self.hasMountains,
                             hemisphere=self.hemisphere,
                             isIsland=self.isIsland,
-                            seaLevel=self.seaLevel
+                            seaLevel=self.seaLevel,
+                            seed=self.seed
                             )
-
-            settingsTable.append(list(settings.items()))
-            settingsTable.cols.key.createIndex()  # create an index
-            
-            h5file.close()
-            del h5file, h5Filter            
+            saveWorld(self.fileLocation, self.world, settings)
 
     def saveWorldAs(self):
         '''Present a save world dialog'''
@@ -585,6 +624,10 @@ class MapGen(QtGui.QMainWindow):
         self.hasMountains=settings[b'hasMountains']
         self.isIsland=settings[b'isIsland']
         self.seaLevel=settings[b'seaLevel']
+        if b'seed' in settings: # regenerates any layer as it was
+            self.seed=int(settings[b'seed'])
+        else: # saved before worlds had seeds
+            self.seed=newSeed()
         
         #TODO: apply to edit screen
         